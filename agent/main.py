@@ -2,49 +2,64 @@
 from __future__ import annotations
 
 import argparse
-import json
-import subprocess
+import asyncio
 import sys
 from pathlib import Path
 
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
 
 # Allow importing utils.*
 ROOT = Path(__file__).resolve().parent.parent
 if str(ROOT) not in sys.path:
     sys.path.append(str(ROOT))
 
-from utils.router_chain import parse_signals, build_router_messages  
+from utils.router_chain import (
+    build_router_messages,
+    classify_by_keywords,
+    get_router_llm,
+    parse_signals,
+    signal_values,
+)
+from utils.hybrid_retrieve import arun as hybrid_arun
+from utils.json_codec import json_dumps, json_loads
+
+# Load environment variables once at import
+load_dotenv()
+
+# Keywords of manual sections whose hits are reliably answerable by RAG; matched
+# as substrings of the upper-cased section paths ("Troubleshooting and repairs / ...")
+RAG_SECTIONS = ("TROUBLESHOOTING", "FAQ", "USAGE")
 
 
 def decide_action(query: str, signals: dict, model: str, temperature: float):
-    top1 = float(signals.get("top1", 0) or 0)
-    avg5 = float(signals.get("avg_top5", 0) or 0)
-    hits = int(signals.get("hits", 0) or 0)
+    top1, avg5, hits = signal_values(signals)
     if top1 >= 0.7 and avg5 >= 0.5 and hits >= 3:
         return {"action": "rag", "confidence": 0.9, "reason": "High retrieval scores"}
     if top1 < 0.35 or avg5 < 0.30 or hits < 3:
         return {"action": "escalate", "confidence": 0.9, "reason": "Low retrieval scores"}
 
+    # Cheap keyword and section rules settle most of the gray zone without an
+    # LLM call; clear api/escalate intents win over the missing-sections fallback
+    decision = classify_by_keywords(query)
+    if decision is not None:
+        return decision
+    sections = [str(sec).upper() for sec in signals.get("sections") or []]
+    if top1 >= 0.5 and any(key in sec for sec in sections for key in RAG_SECTIONS):
+        return {"action": "rag", "confidence": 0.8, "reason": "Section match"}
+    if not sections and avg5 < 0.4:
+        return {"action": "escalate", "confidence": 0.8, "reason": "No section match"}
+
     messages = build_router_messages(query, signals)
-    llm = ChatOpenAI(model=model, temperature=temperature)
+    llm = get_router_llm(model, temperature)
     resp = llm.invoke(messages)
     try:
-        return json.loads(resp.content)
+        return json_loads(resp.content)
     except Exception:
         return {"action": "escalate", "confidence": 0.5, "reason": "Router parse failure"}
 
 
-def run_hybrid_retrieve(query: str):
-    cmd = [
-        sys.executable,
-        str(ROOT / "utils" / "hybrid_retrieve.py"),
-        "--query",
-        query,
-    ]
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    return result.stdout, result.stderr, result.returncode
+async def run_hybrid_retrieve(query: str) -> dict:
+    return await hybrid_arun(query)
 
 
 def main():
@@ -63,8 +78,6 @@ def main():
     parser.add_argument("--router-temperature", type=float, default=0.0)
     args = parser.parse_args()
 
-    load_dotenv()
-
     signals = parse_signals(args.retrieval_signals)
     if args.top1 is not None:
         signals["top1"] = args.top1
@@ -76,15 +89,18 @@ def main():
         signals["sections"] = args.sections
 
     decision = decide_action(args.query, signals, args.router_model, args.router_temperature)
-    print(json.dumps({"router_decision": decision, "signals": signals}, ensure_ascii=False))
+    print(json_dumps({"router_decision": decision, "signals": signals}))
 
     if decision.get("action") == "rag":
-        out, err, rc = run_hybrid_retrieve(args.query)
-        print("=== RAG OUTPUT ===")
-        print(out)
-        if err:
-            print("=== RAG STDERR ===")
-            print(err)
+        try:
+            result = asyncio.run(run_hybrid_retrieve(args.query))
+        except Exception as e:
+            print("=== RAG ERROR ===")
+            print(str(e))
+        else:
+            print("=== RAG OUTPUT ===")
+            output = result["final"] if result["final"] is not None else {"context": result["context"]}
+            print(json_dumps(output))
     else:
         print("=== ESCALATE ===")
         print("Escalating to support/help desk based on routing decision.")
@@ -1,15 +1,18 @@
 """Streamlit frontend for RAG chatbot with routing."""
 from __future__ import annotations
 
+import asyncio
 import json
-import subprocess
 import sys
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional, Tuple
 
+import chromadb
+import numpy as np
 import streamlit as st
 from dotenv import load_dotenv
+from langchain_openai import OpenAIEmbeddings
 
 # Ensure project root import
 ROOT = Path(__file__).resolve().parent
@@ -20,10 +23,33 @@ from tools.rag_tool import create_rag_tool
 from tools.escalate_tool import create_escalate_tool
 from tools.api_tool import create_api_tool
 from utils.memory_manager import create_memory_manager
+from utils.embed_batcher import EmbeddingBatcher
+from utils.embed_cache import CachedEmbedder
+from utils.hybrid_retrieve import DEFAULT_CHUNKS_PATH, load_bm25_index
+from utils.json_codec import json_dumps, json_loads, json_loads_llm
+from utils.llm_answer import get_chat_llm
+from utils.prompt_config import build_messages_unified
+from utils.router_cache import get_router_cache
+from utils.router_chain import (
+    ESCALATE_THRESHOLDS,
+    RAG_THRESHOLDS,
+    apply_hard_rules,
+    classify_by_keywords,
+    decide_action,
+)
 
 # Load environment variables
 load_dotenv()
 
+# Model behind both routing paths (router-only and unified); also keys the router cache
+ROUTER_MODEL = "gpt-4o-mini"
+
+# Sidebar legend for the hard rules, built from the thresholds apply_hard_rules uses
+HARD_RULES_LEGEND = (
+    "*✅ RAG if: top1≥{} AND avg5≥{} AND hits≥{}*\n"
+    "*❌ Escalate if: top1<{} OR avg5<{} OR hits<{}*\n"
+).format(*RAG_THRESHOLDS, *ESCALATE_THRESHOLDS)
+
 # Page configuration
 st.set_page_config(
     page_title="Assistant Support",
@@ -32,138 +58,162 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
+
+@st.cache_data
+def load_css() -> str:
+    """Read the dark theme stylesheet once; reruns reuse the cached string."""
+    return (ROOT / "static" / "theme.css").read_text(encoding="utf-8")
+
+
 # Custom CSS - Dark Theme
-st.markdown("""
-<style>
-    /* Main container background */
-    .stApp {
-        background-color: #1a1a1a;
-    }
-    
-    /* Header styling */
-    .main-header {
-        font-size: 2.5rem;
-        font-weight: bold;
-        color: #ffffff;
-        text-align: center;
-        padding: 1rem 0;
-    }
-    
-    /* Base chat message styling - black bubble with white text */
-    .chat-message {
-        padding: 1.2rem;
-        border-radius: 1rem;
-        margin-bottom: 1rem;
-        background-color: #000000;
-        color: #ffffff;
-        box-shadow: 0 2px 8px rgba(0, 0, 0, 0.3);
-    }
+st.markdown(f"<style>{load_css()}</style>", unsafe_allow_html=True)
+
+
+@st.cache_resource
+def get_chroma_collection():
+    """Open the persisted Chroma text collection once per server process."""
+    client = chromadb.PersistentClient(path="chroma_db")
+    return client.get_collection("coffee_text")
+
+
+@st.cache_resource
+def get_embedder() -> CachedEmbedder:
+    """Build the query embedder once per server process (disk-cached vectors)."""
+    return CachedEmbedder(OpenAIEmbeddings(model="text-embedding-3-large"), "text-embedding-3-large")
+
+
+@st.cache_resource
+def get_embedding_batcher() -> EmbeddingBatcher:
+    """Share one micro-batching embedder across sessions so concurrent turns coalesce."""
+    return EmbeddingBatcher(get_embedder())
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def compute_signals(user_query: str) -> Tuple[dict, List[float], List[Tuple[str, str]]]:
+    """Embed the query and derive router signals from a top-5 Chroma search.
     
-    .chat-message strong {
-        color: #ffffff;
-    }
+    Returns the signals together with the query embedding (so the RAG tool can
+    reuse it instead of embedding the same query a second time) and the
+    retrieved ``(chunk_id, text)`` pairs used by the gray-zone unified call.
+    """
+    batcher = get_embedding_batcher()
+    collection = get_chroma_collection()
     
-    /* User message - black with blue accent */
-    .user-message {
-        background-color: #000000;
-        border-left: 5px solid #2196f3;
-        color: #ffffff;
-    }
+    # Get query embedding (batched with any concurrent turns) and search
+    q_vec = batcher.embed_query(user_query)
+    res = collection.query(
+        query_embeddings=[q_vec],
+        n_results=5,
+        include=["distances"],
+    )
     
-    /* Assistant message - black with green accent */
-    .assistant-message {
-        background-color: #000000;
-        border-left: 5px solid #4caf50;
-        color: #ffffff;
-    }
+    # Calculate retrieval signals
+    ids = res["ids"][0]
+    if not ids:
+        return {"top1": 0.0, "avg_top5": 0.0, "hits": 0, "sections": []}, q_vec, []
     
-    /* Error message - black with red accent */
-    .error-message {
-        background-color: #000000;
-        border-left: 5px solid #f44336;
-        color: #ffffff;
-    }
+    scores = 1.0 / (1.0 + np.asarray(res["distances"][0], dtype=np.float32))
+    top1 = float(scores[0]) if scores.size else 0.0
+    avg_top5 = float(scores[:5].mean()) if scores.size else 0.0
+    hits = int(scores.size)
+    signals = {"top1": top1, "avg_top5": avg_top5, "hits": hits, "sections": []}
     
-    /* Escalate message - black with orange accent */
-    .escalate-message {
-        background-color: #000000;
-        border-left: 5px solid #ff9800;
-        color: #ffffff;
-    }
+    # Hard escalations need neither section names nor chunk texts; the rag fast
+    # path only needs sections for display; the gray zone needs both
+    decision = apply_hard_rules(signals)
+    if decision is not None and decision["action"] == "escalate":
+        return signals, q_vec, []
+    include = ["metadatas"] if decision is not None else ["metadatas", "documents"]
+    rows = collection.get(ids=ids, include=include)
+    row_of = {doc_id: i for i, doc_id in enumerate(rows["ids"])}
+    order = [row_of[doc_id] for doc_id in ids if doc_id in row_of]
+    metadatas = [rows["metadatas"][i] for i in order]
     
-    /* Confidence indicators - keep original colors for visibility */
-    .confidence-high {
-        color: #4caf50;
-        font-weight: bold;
-    }
-    .confidence-medium {
-        color: #ff9800;
-        font-weight: bold;
-    }
-    .confidence-low {
-        color: #f44336;
-        font-weight: bold;
-    }
+    # Ordered dedup keeps the best-ranked sections first
+    sections = list(dict.fromkeys(m["section_path"] for m in metadatas if m.get("section_path")))
+    signals["sections"] = sections[:3]  # Top 3 sections
+    context = []
+    if "documents" in include:
+        context = [
+            (f"{m.get('source', '')}:{m.get('block_idx', -1)}", rows["documents"][i] or "")
+            for m, i in zip(metadatas, order)
+        ]
     
-    /* Ensure all text in chat messages is white */
-    .chat-message p, .chat-message div, .chat-message span {
-        color: #ffffff !important;
-    }
-</style>
-""", unsafe_allow_html=True)
+    return signals, q_vec, context
+
+
+async def prepare(user_query: str) -> Tuple[dict, List[float], List[Tuple[str, str]]]:
+    """Compute retrieval signals while the RAG tool's BM25 index loads in parallel."""
+    signals, _ = await asyncio.gather(
+        asyncio.to_thread(compute_signals, user_query),
+        asyncio.to_thread(load_bm25_index, DEFAULT_CHUNKS_PATH),
+        return_exceptions=True,
+    )
+    # A failed BM25 warm-up is not fatal; the RAG tool will retry the load itself
+    if isinstance(signals, BaseException):
+        raise signals
+    return signals
 
 
-def call_router(query: str, retrieval_signals: Optional[dict] = None) -> dict:
+def call_router(
+    query: str,
+    retrieval_signals: Optional[dict] = None,
+    query_embedding: Optional[List[float]] = None,
+) -> dict:
     """Call the router to decide which action to take."""
     if retrieval_signals is None:
         retrieval_signals = {}
     
     try:
-        router_args = [
-            "--query", query,
-            "--retrieval-signals", json.dumps(retrieval_signals, ensure_ascii=False)
-        ]
-        
-        router_process = subprocess.run(
-            [sys.executable, str(ROOT / "utils" / "router_chain.py")] + router_args,
-            capture_output=True,
-            text=True,
-            encoding="utf-8",
+        return decide_action(
+            query,
+            retrieval_signals,
+            model=ROUTER_MODEL,
+            temperature=0.0,
             timeout=30,
+            query_embedding=query_embedding,
         )
-        
-        if router_process.returncode != 0:
-            return {
-                "action": "escalate",
-                "confidence": 0.0,
-                "reason": "Router error",
-                "error": router_process.stderr[:500]
-            }
-        
-        # Parse output - router prints debug info and then the decision
-        lines = router_process.stdout.strip().split('\n')
-        for line in reversed(lines):
-            line = line.strip()
-            if line.startswith('{') and '"action"' in line:
-                try:
-                    result = json.loads(line)
-                    if "action" in result:
-                        return result
-                except json.JSONDecodeError:
-                    continue
-        
-        # Fallback
+    except Exception as e:
         return {
             "action": "escalate",
-            "confidence": 0.5,
-            "reason": "Could not parse router output"
+            "confidence": 0.0,
+            "reason": f"Router exception: {str(e)}"
         }
-        
-    except subprocess.TimeoutExpired:
+
+
+def call_unified(
+    query: str,
+    retrieval_signals: dict,
+    context: List[Tuple[str, str]],
+    query_embedding: Optional[List[float]] = None,
+) -> dict:
+    """Route a gray-zone query with its pre-retrieved chunks in the prompt.
+    
+    Returns the router fields (action/confidence/reason) only: a ``rag`` decision
+    is answered by the RAG tool, with the sidebar's retrieval settings. Parsed
+    decisions are stored in the router cache, with the query embedding, for
+    later gray-zone turns.
+    """
+    try:
+        messages = build_messages_unified(
+            query,
+            [text for _, text in context],
+            [cid for cid, _ in context],
+            retrieval_signals,
+        )
+        llm = get_chat_llm(ROUTER_MODEL, 0.0, 30)
+        resp = llm.invoke(messages)
+        result = json_loads_llm(resp.content)
+        if not isinstance(result, dict) or "action" not in result:
+            raise json.JSONDecodeError("missing action", resp.content, 0)
+        route = {key: result.get(key) for key in ("action", "confidence", "reason")}
+        get_router_cache(ROUTER_MODEL).put(query, retrieval_signals, route, query_embedding)
+        return route
+    except json.JSONDecodeError:
         return {
             "action": "escalate",
-            "confidence": 0.0,
-            "reason": "Router timeout"
+            "confidence": 0.5,
+            "reason": "Could not parse router output"
         }
     except Exception as e:
         return {
@@ -187,6 +237,34 @@ def format_confidence(confidence: float) -> str:
     return f'<span class="{cls}">{label} ({confidence:.2f})</span>'
 
 
+def render_message_html(message: dict) -> str:
+    """Build the chat bubble HTML for a history message."""
+    content = message["content"]
+    if message["role"] == "user":
+        return f'<div class="chat-message user-message"><strong>You:</strong><br>{content}</div>'
+    
+    metadata = message.get("metadata", {})
+    action = metadata.get("action", "unknown")
+    confidence = metadata.get("confidence", 0.0)
+    
+    if action == "escalate":
+        msg_class = "escalate-message"
+        icon = "🎫"
+    elif metadata.get("error"):
+        msg_class = "error-message"
+        icon = "❌"
+    else:
+        msg_class = "assistant-message"
+        icon = "✅"
+    
+    return (
+        f'<div class="chat-message {msg_class}">'
+        f'<strong>{icon} Assistant (Action: {action}, Confidence: {format_confidence(confidence)}):</strong><br>'
+        f'{content}'
+        f'</div>'
+    )
+
+
 def main():
     """Main Streamlit application."""
     
@@ -237,34 +315,14 @@ def main():
     
     # Display chat history
     for message in st.session_state.messages:
-        role = message["role"]
-        content = message["content"]
         metadata = message.get("metadata", {})
         
-        if role == "user":
-            st.markdown(f'<div class="chat-message user-message"><strong>You:</strong><br>{content}</div>', unsafe_allow_html=True)
-        elif role == "assistant":
-            action = metadata.get("action", "unknown")
-            confidence = metadata.get("confidence", 0.0)
-            
-            if action == "escalate":
-                msg_class = "escalate-message"
-                icon = "🎫"
-            elif metadata.get("error"):
-                msg_class = "error-message"
-                icon = "❌"
-            else:
-                msg_class = "assistant-message"
-                icon = "✅"
-            
-            st.markdown(
-                f'<div class="chat-message {msg_class}">'
-                f'<strong>{icon} Assistant (Action: {action}, Confidence: {format_confidence(confidence)}):</strong><br>'
-                f'{content}'
-                f'</div>',
-                unsafe_allow_html=True
-            )
-            
+        # HTML is built once per message and reused on every later rerun
+        if "_html" not in message:
+            message["_html"] = render_message_html(message)
+        st.markdown(message["_html"], unsafe_allow_html=True)
+        
+        if message["role"] == "assistant":
             # Show sources if available (for RAG)
             if metadata.get("sources"):
                 with st.expander("📚 View Sources"):
@@ -280,58 +338,28 @@ def main():
     
     if user_query:
         # Add user message to history and memory
-        st.session_state.messages.append({
+        user_message = {
             "role": "user",
             "content": user_query,
             "timestamp": datetime.now().isoformat()
-        })
+        }
+        user_message["_html"] = render_message_html(user_message)
+        st.session_state.messages.append(user_message)
         st.session_state.memory.add_user_message(user_query)
         
         # Show user message
-        st.markdown(f'<div class="chat-message user-message"><strong>You:</strong><br>{user_query}</div>', unsafe_allow_html=True)
+        st.markdown(user_message["_html"], unsafe_allow_html=True)
         
         # Processing indicator
         with st.spinner("🤔 Thinking..."):
             # Step 1: Pre-retrieve to get real retrieval signals (unless manual override)
+            query_embedding = None
+            context = []
             if not use_manual_signals:
                 with st.spinner("🔍 Analyzing query..."):
                     # Quick retrieval to get signals for router
                     try:
-                        import chromadb
-                        from langchain_openai import OpenAIEmbeddings
-                        from dotenv import load_dotenv
-                        import os
-                        
-                        load_dotenv()
-                        embedder = OpenAIEmbeddings(model="text-embedding-3-large")
-                        client = chromadb.PersistentClient(path="chroma_db")
-                        collection = client.get_collection("coffee_text")
-                        
-                        # Get query embedding and search
-                        q_vec = embedder.embed_query(user_query)
-                        res = collection.query(
-                            query_embeddings=[q_vec],
-                            n_results=5,
-                            include=["metadatas", "distances"],
-                        )
-                        
-                        # Calculate retrieval signals
-                        if res["ids"][0]:
-                            distances = res["distances"][0]
-                            scores = [1.0 / (1.0 + d) for d in distances]
-                            top1 = scores[0] if scores else 0.0
-                            avg_top5 = sum(scores[:5]) / len(scores) if scores else 0.0
-                            hits = len(scores)
-                            sections = list(set([m.get("section_path", "") for m in res["metadatas"][0] if m.get("section_path")]))
-                            
-                            retrieval_signals = {
-                                "top1": top1,
-                                "avg_top5": avg_top5,
-                                "hits": hits,
-                                "sections": sections[:3]  # Top 3 sections
-                            }
-                        else:
-                            retrieval_signals = {"top1": 0.0, "avg_top5": 0.0, "hits": 0, "sections": []}
+                        retrieval_signals, query_embedding, context = asyncio.run(prepare(user_query))
                     except Exception as e:
                         st.warning(f"Pre-retrieval failed: {str(e)[:100]}. Using empty signals.")
                         retrieval_signals = {"top1": 0.0, "avg_top5": 0.0, "hits": 0, "sections": []}
@@ -345,12 +373,26 @@ def main():
                           f"- Avg Top5: **{retrieval_signals.get('avg_top5', 0):.4f}**\n"
                           f"- Hits: **{retrieval_signals.get('hits', 0)}**\n"
                           f"- Sections: {', '.join(retrieval_signals.get('sections', [])[:2]) or 'None'}\n\n"
-                          f"*✅ RAG if: top1≥0.5 AND avg5≥0.35 AND hits≥3*\n"
-                          f"*❌ Escalate if: top1<0.25 OR avg5<0.20 OR hits<2*\n"
-                          f"*🤔 Gray zone: LLM decides by intent*")
+                          + HARD_RULES_LEGEND
+                          + "*🤔 Gray zone: LLM decides by intent*")
             
-            # Step 2: Call router with real retrieval signals
-            router_decision = call_router(user_query, retrieval_signals=retrieval_signals)
+            # Step 2: Hard rules and trigger keywords decide clear cases; in the gray zone,
+            # route with one LLM call that also sees the pre-retrieved chunks when we have them
+            router_decision = apply_hard_rules(retrieval_signals) or classify_by_keywords(user_query)
+            if router_decision is None:
+                if context:
+                    # A past decision for the same or a near-duplicate query, or (opt-in)
+                    # a clear nearest-centroid prediction from the cached ones, skips the LLM
+                    router_cache = get_router_cache(ROUTER_MODEL)
+                    router_decision = router_cache.get(
+                        user_query, retrieval_signals, query_embedding
+                    ) or router_cache.classify(query_embedding)
+                    if router_decision is None:
+                        router_decision = call_unified(user_query, retrieval_signals, context, query_embedding)
+                else:
+                    router_decision = call_router(
+                        user_query, retrieval_signals=retrieval_signals, query_embedding=query_embedding
+                    )
             
             action = router_decision.get("action", "escalate")
             confidence = router_decision.get("confidence", 0.0)
@@ -369,21 +411,23 @@ def main():
             }
             
             if action == "rag":
-                # Use RAG tool with all configuration parameters
-                rag_tool = create_rag_tool(
-                    k_dense=k_dense,
-                    k_sparse=k_sparse,
-                    top_fuse=top_fuse,
-                    top_rerank=top_rerank,
-                    neighbor_radius=neighbor_radius,
-                    max_context_tokens=max_context_tokens,
-                )
-                
                 with st.spinner("🔍 Searching knowledge base..."):
-                    rag_result_str = rag_tool._run(user_query)
+                    # Use RAG tool with all configuration parameters
+                    rag_tool = create_rag_tool(
+                        k_dense=k_dense,
+                        k_sparse=k_sparse,
+                        top_fuse=top_fuse,
+                        top_rerank=top_rerank,
+                        neighbor_radius=neighbor_radius,
+                        max_context_tokens=max_context_tokens,
+                        query_embedding=query_embedding,
+                    )
+                    # Show the answer text as it streams; the JSON result arrives at the end
+                    st.write_stream(rag_tool._stream(user_query))
+                    rag_result_str = rag_tool.last_result
                     
                     try:
-                        rag_result = json.loads(rag_result_str)
+                        rag_result = json_loads(rag_result_str)
                         
                         # DEBUG: Show RAG result in sidebar
                         with st.sidebar:
@@ -401,22 +445,22 @@ def main():
                             # If RAG confidence is too low, escalate
                             if rag_result.get("confidence", 0.0) < 0.5:
                                 escalate_tool = create_escalate_tool()
-                                escalate_result_str = escalate_tool._run(json.dumps({
+                                escalate_result_str = escalate_tool._run(json_dumps({
                                     "query": user_query,
                                     "reason": "RAG confidence too low"
                                 }))
-                                escalate_result = json.loads(escalate_result_str)
+                                escalate_result = json_loads(escalate_result_str)
                                 response_content = escalate_result.get("message", response_content)
                                 response_metadata["action"] = "escalate"
                                 response_metadata["ticket_id"] = escalate_result.get("ticket_id")
                         else:
                             # RAG says it cannot answer, escalate
                             escalate_tool = create_escalate_tool()
-                            escalate_result_str = escalate_tool._run(json.dumps({
+                            escalate_result_str = escalate_tool._run(json_dumps({
                                 "query": user_query,
                                 "reason": rag_result.get("reason", "RAG cannot answer")
                             }))
-                            escalate_result = json.loads(escalate_result_str)
+                            escalate_result = json_loads(escalate_result_str)
                             response_content = escalate_result.get("message", "Unable to answer")
                             response_metadata["action"] = "escalate"
                             response_metadata["ticket_id"] = escalate_result.get("ticket_id")
@@ -429,13 +473,13 @@ def main():
                 # Use escalate tool
                 escalate_tool = create_escalate_tool()
                 with st.spinner("🎫 Creating support ticket..."):
-                    escalate_result_str = escalate_tool._run(json.dumps({
+                    escalate_result_str = escalate_tool._run(json_dumps({
                         "query": user_query,
                         "reason": reason
                     }))
                     
                     try:
-                        escalate_result = json.loads(escalate_result_str)
+                        escalate_result = json_loads(escalate_result_str)
                         response_content = escalate_result.get("message", "Support ticket created")
                         response_metadata["ticket_id"] = escalate_result.get("ticket_id")
                     except json.JSONDecodeError:
@@ -449,7 +493,7 @@ def main():
                     api_result_str = api_tool._run(user_query)
                     
                     try:
-                        api_result = json.loads(api_result_str)
+                        api_result = json_loads(api_result_str)
                         
                         if api_result.get("status") == "success":
                             data = api_result.get("data", {})
@@ -457,9 +501,7 @@ def main():
                             
                             # Use LLM to summarize the API response with conversation context
                             with st.spinner("🤖 Generating summary..."):
-                                from langchain_openai import ChatOpenAI
-                                
-                                llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.2)
+                                llm = get_chat_llm("gpt-4o-mini", 0.2)
                                 
                                 summary_system_prompt = (
                                     "You are a helpful assistant that summarizes API responses. "
@@ -471,7 +513,7 @@ def main():
                                 
                                 current_query_with_data = (
                                     f"API Response Type: {query_type}\n\n"
-                                    f"API Data:\n{json.dumps(data, indent=2, ensure_ascii=False)}\n\n"
+                                    f"API Data:\n{json_dumps(data, indent=True)}\n\n"
                                     f"Current Question: {user_query}\n\n"
                                     f"Please summarize this information in a natural, user-friendly way, "
                                     f"considering the conversation context above."
@@ -491,7 +533,7 @@ def main():
                             response_metadata["summary_mode"] = True
                             
                             # Store raw JSON for expandable view
-                            response_metadata["raw_json"] = json.dumps(data, indent=2, ensure_ascii=False)
+                            response_metadata["raw_json"] = json_dumps(data, indent=True)
                         else:
                             response_content = f"**API Error:** {api_result.get('message', 'Unknown error')}"
                             response_metadata["error"] = True
@@ -510,12 +552,14 @@ def main():
                 response_metadata["error"] = True
         
         # Add assistant response to history and memory
-        st.session_state.messages.append({
+        assistant_message = {
             "role": "assistant",
             "content": response_content,
             "metadata": response_metadata,
             "timestamp": datetime.now().isoformat()
-        })
+        }
+        assistant_message["_html"] = render_message_html(assistant_message)
+        st.session_state.messages.append(assistant_message)
         st.session_state.memory.add_ai_message(response_content, metadata=response_metadata)
         
         # Rerun to show the new message
@@ -1,5 +1,6 @@
 """Test script for API Tool - demonstrates mock API calls."""
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # Ensure project root import
@@ -9,87 +10,65 @@ if str(ROOT) not in sys.path:
 
 from tools.api_tool import create_api_tool
 
+# Shared across tests (and the __main__ runner); the tool holds no per-call state
+api_tool = create_api_tool(mock_delay=0.1)
+
+
+def report(title: str, query: str, result: str) -> None:
+    """Print one test's output as a single block so concurrent runs don't interleave."""
+    print(
+        "\n" + "="*80 + "\n"
+        + title + "\n"
+        + "="*80 + "\n"
+        + f"\nQuery: {query}\n"
+        + f"\nResult:\n{result}"
+    )
+
 
 def test_order_status():
     """Test order status query."""
-    print("\n" + "="*80)
-    print("TEST 1: Order Status Query")
-    print("="*80)
-    
-    api_tool = create_api_tool(mock_delay=0.1)
-    
     # Method 1: JSON input
     query = '{"query_type": "order_status", "parameters": {"order_id": "ORD12345"}}'
     result = api_tool._run(query)
-    print(f"\nQuery: {query}")
-    print(f"\nResult:\n{result}")
+    report("TEST 1: Order Status Query", query, result)
 
 
 def test_inventory():
     """Test inventory check."""
-    print("\n" + "="*80)
-    print("TEST 2: Inventory Check")
-    print("="*80)
-    
-    api_tool = create_api_tool(mock_delay=0.1)
-    
     # Method 2: Plain text (auto-detection)
     query = "check inventory for product PROD001"
     result = api_tool._run(query)
-    print(f"\nQuery: {query}")
-    print(f"\nResult:\n{result}")
+    report("TEST 2: Inventory Check", query, result)
 
 
 def test_product_info():
     """Test product information query."""
-    print("\n" + "="*80)
-    print("TEST 3: Product Information")
-    print("="*80)
-    
-    api_tool = create_api_tool(mock_delay=0.1)
-    
     query = '{"query_type": "product_info", "parameters": {"product_id": "PROD001"}}'
     result = api_tool._run(query)
-    print(f"\nQuery: {query}")
-    print(f"\nResult:\n{result}")
+    report("TEST 3: Product Information", query, result)
 
 
 def test_service_status():
     """Test service status check."""
-    print("\n" + "="*80)
-    print("TEST 4: Service Status")
-    print("="*80)
-    
-    api_tool = create_api_tool(mock_delay=0.1)
-    
     query = "what is the service status"
     result = api_tool._run(query)
-    print(f"\nQuery: {query}")
-    print(f"\nResult:\n{result}")
+    report("TEST 4: Service Status", query, result)
 
 
 def test_invalid_query():
     """Test invalid query handling."""
-    print("\n" + "="*80)
-    print("TEST 5: Invalid Query")
-    print("="*80)
-    
-    api_tool = create_api_tool(mock_delay=0.1)
-    
     query = "this is a random query"
     result = api_tool._run(query)
-    print(f"\nQuery: {query}")
-    print(f"\nResult:\n{result}")
+    report("TEST 5: Invalid Query", query, result)
 
 
 if __name__ == "__main__":
     print("\n🧪 Testing API Tool - Mock API Calls\n")
     
-    test_order_status()
-    test_inventory()
-    test_product_info()
-    test_service_status()
-    test_invalid_query()
+    tests = [test_order_status, test_inventory, test_product_info, test_service_status, test_invalid_query]
+    # mock_delay is a sleep, so running the tests concurrently overlaps the waits
+    with ThreadPoolExecutor(max_workers=len(tests)) as ex:
+        list(ex.map(lambda f: f(), tests))
     
     print("\n" + "="*80)
     print("✅ All tests completed!")
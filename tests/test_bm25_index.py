@@ -0,0 +1,58 @@
+"""Parity tests: the CSR BM25 index scores like rank_bm25.BM25Okapi, which it replaced."""
+import sys
+import tempfile
+from pathlib import Path
+
+# Ensure project root import
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from utils.bm25_index import build_and_save, load_bm25
+
+CHUNKS = [
+    {"text": "descale the machine every month"},
+    {"text": "the milk frother needs cleaning after use"},
+    {"text": "error E05 means the water tank is empty"},
+    {"text": "fill the water tank and restart the machine"},
+    {"text": "the grinder setting controls coffee strength"},
+    {"text": "   "},  # blank chunks are not indexed
+]
+
+# BM25Okapi(k1=1.5, b=0.75, epsilon=0.25).get_scores over the five non-blank
+# chunks, one score per chunk row. "the" is in every chunk, so its negative
+# idf is floored to epsilon * mean idf.
+EXPECTED = {
+    "water tank empty": [0.0, 0.0, 1.641224, 0.623436, 0.0],
+    "the machine": [0.630641, 0.216187, 0.202933, 0.607847, 0.231293],
+    "descale grinder": [1.247173, 0.0, 0.0, 0.0, 1.160025],
+    "unknown words": [0.0, 0.0, 0.0, 0.0, 0.0],
+}
+
+
+def load_index():
+    out_dir = Path(tempfile.mkdtemp()) / "chunks.bm25"
+    build_and_save(CHUNKS, out_dir)
+    return load_bm25(out_dir)
+
+
+def test_scores_match_rank_bm25():
+    index = load_index()
+    assert len(index) == 5
+    for query, expected in EXPECTED.items():
+        scores = dict(index.search(query, k=len(CHUNKS)))
+        for row, want in enumerate(expected):
+            assert abs(scores[row] - want) < 1e-5, (query, row, scores[row], want)
+
+
+def test_search_ranks_best_first():
+    index = load_index()
+    hits = index.search("water tank empty", k=2)
+    assert [row for row, _ in hits] == [2, 3]
+    assert index.search("the machine", k=0) == []
+
+
+if __name__ == "__main__":
+    for test in (test_scores_match_rank_bm25, test_search_ranks_best_first):
+        test()
+        print(f"✅ {test.__name__}")
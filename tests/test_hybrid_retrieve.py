@@ -0,0 +1,104 @@
+"""Tests for the pure helpers of hybrid retrieval (no Chroma, models or network needed)."""
+import json
+import sys
+from pathlib import Path
+
+# Ensure project root import
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from utils.hybrid_retrieve import Hit, JSONFieldStreamer, dedup_results, rrf_fuse
+
+
+def hit(doc_id: str, source: str = "manual.md", block_idx: int = 0) -> Hit:
+    return Hit(doc_id, 0.0, {"source": source, "block_idx": block_idx}, f"text of {doc_id}")
+
+
+def reference_rrf(dense, sparse, k=60, top_n=50):
+    """The original dict-and-sorted RRF that the NumPy version replaced."""
+    pool = {}
+    for hits in (dense, sparse):
+        for rank, h in enumerate(hits, start=1):
+            prev = pool.get(h.doc_id, (0.0, None))[0]
+            pool[h.doc_id] = (prev + 1.0 / (k + rank), h)
+    fused = sorted(pool.items(), key=lambda x: x[1][0], reverse=True)
+    return [(doc_id, score, h.meta, h.doc) for doc_id, (score, h) in fused[:top_n]]
+
+
+def test_rrf_fuse_matches_reference():
+    dense = [hit(f"d{i}") for i in range(6)] + [hit("both1"), hit("both2")]
+    sparse = [hit("both2"), hit("s0"), hit("both1"), hit("s1"), hit("d3")]
+    for top_n in (3, 50):
+        got = [(h.doc_id, h.score, h.meta, h.doc) for h in rrf_fuse(dense, sparse, top_n=top_n)]
+        want = reference_rrf(dense, sparse, top_n=top_n)
+        assert [g[0] for g in got] == [w[0] for w in want], top_n
+        for g, w in zip(got, want):
+            assert abs(g[1] - w[1]) < 1e-12 and g[2:] == w[2:]
+
+
+def test_rrf_fuse_ties_keep_first_seen_order():
+    # Same rank in both lists -> equal scores; dense hits come first
+    fused = rrf_fuse([hit("a"), hit("b")], [hit("x"), hit("y")])
+    assert [h.doc_id for h in fused] == ["a", "x", "b", "y"]
+    assert rrf_fuse([], []) == []
+
+
+def test_dedup_results_keeps_first_of_each_block():
+    items = [
+        hit("a", block_idx=1),
+        hit("b", block_idx=2),
+        hit("c", block_idx=1),  # duplicate of "a"'s block
+        hit("d", source="other.md", block_idx=1),
+        hit("e", block_idx=2),
+    ]
+    assert [h.doc_id for h in dedup_results(items)] == ["a", "b", "d"]
+    assert dedup_results([]) == []
+
+
+def stream_field(raw: str, pieces: int) -> str:
+    """Feed ``raw`` to a streamer for "answer" in ``pieces`` roughly equal chunks."""
+    streamer = JSONFieldStreamer("answer")
+    step = max(1, len(raw) // pieces)
+    return "".join(streamer.feed(raw[i : i + step]) for i in range(0, len(raw), step))
+
+
+def test_streamer_matches_json_decoding():
+    """Any chunking decodes the field exactly as json.loads does."""
+    answer = 'Descale "monthly":\n1. Fill\\tthe tank / run ☕ 🚰 café'
+    raw = json.dumps({"can_answer": True, "answer": answer, "sources": ["a:1"]})
+    for pieces in (1, 2, 7, len(raw)):
+        assert stream_field(raw, pieces) == answer, pieces
+
+
+def test_streamer_joins_surrogate_pairs():
+    """A \\uD83D\\uDEB0 pair (ensure_ascii output) becomes one character, even when split."""
+    raw = '{"answer": "tap \\ud83d\\udeb0 here", "sources": []}'
+    for pieces in (1, 3, len(raw)):
+        assert stream_field(raw, pieces) == "tap \U0001F6B0 here", pieces
+
+
+def test_streamer_replaces_lone_surrogates():
+    raw = '{"answer": "a\\ud83d b \\udeb0c"}'
+    assert stream_field(raw, 1) == "a� b �c"
+
+
+def test_streamer_stops_at_closing_quote():
+    streamer = JSONFieldStreamer("answer")
+    assert streamer.feed('{"reason": "x", "answer": "done"') == "done"
+    assert streamer.feed(', "answer": "again"}') == ""
+
+
+if __name__ == "__main__":
+    tests = [
+        test_rrf_fuse_matches_reference,
+        test_rrf_fuse_ties_keep_first_seen_order,
+        test_dedup_results_keeps_first_of_each_block,
+        test_streamer_matches_json_decoding,
+        test_streamer_joins_surrogate_pairs,
+        test_streamer_replaces_lone_surrogates,
+        test_streamer_stops_at_closing_quote,
+    ]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
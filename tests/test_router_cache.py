@@ -0,0 +1,127 @@
+"""Tests for the router decision cache (no LLM or embedding model needed)."""
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+# Ensure project root import
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from utils.router_cache import RouterCache, signal_band
+
+GRAY = {"top1": 0.42, "avg_top5": 0.31, "hits": 3}
+LOWER = {"top1": 0.22, "avg_top5": 0.18, "hits": 3}
+DECISION = {"action": "api", "confidence": 0.8, "reason": "Order lookup"}
+
+
+def new_cache() -> RouterCache:
+    return RouterCache(Path(tempfile.mkdtemp()) / "router.json")
+
+
+def unit(*values):
+    v = np.asarray(values, dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+
+def test_exact_hit_ignores_case_and_punctuation():
+    cache = new_cache()
+    cache.put("Where is my order?", GRAY, DECISION)
+    assert cache.get("where is my ORDER", GRAY) == DECISION
+    assert cache.get("where is my parcel", GRAY) is None
+
+
+def test_near_duplicate_hit_by_embedding():
+    cache = new_cache()
+    cache.put("where is my order", GRAY, DECISION, unit(1.0, 0.0, 0.0))
+    assert cache.get("wheres my order", GRAY, unit(1.0, 0.1, 0.0)) == DECISION
+    assert cache.get("descale the machine", GRAY, unit(0.0, 1.0, 0.0)) is None
+
+
+def test_signal_bands_are_kept_apart():
+    assert signal_band(GRAY) != signal_band(LOWER)
+    cache = new_cache()
+    cache.put("where is my order", GRAY, DECISION, unit(1.0, 0.0, 0.0))
+    assert cache.get("where is my order", LOWER) is None
+    assert cache.get("wheres my order", LOWER, unit(1.0, 0.1, 0.0)) is None
+
+
+def test_flush_persists_and_reloads():
+    cache = new_cache()
+    cache.put("where is my order", GRAY, DECISION, unit(1.0, 0.0, 0.0))
+    assert not cache.path.exists()  # writes are deferred to the flush
+    cache.flush()
+    reloaded = RouterCache(cache.path)
+    assert reloaded.get("where is my order", GRAY) == DECISION
+    assert reloaded.get("wheres my order", GRAY, unit(1.0, 0.1, 0.0)) == DECISION
+
+
+def test_corrupt_files_start_empty():
+    cache = new_cache()
+    cache.path.write_text("{not json", encoding="utf-8")
+    assert RouterCache(cache.path).get("where is my order", GRAY) is None
+
+    cache.put("where is my order", GRAY, DECISION, unit(1.0, 0.0, 0.0))
+    cache.flush()
+    cache.path.with_suffix(".npy").write_bytes(b"garbage")
+    assert RouterCache(cache.path).get("where is my order", GRAY) is None
+
+
+def test_lru_evicts_oldest():
+    cache = RouterCache(Path(tempfile.mkdtemp()) / "router.json", max_entries=2)
+    for query in ("first", "second", "third"):
+        cache.put(query, GRAY, DECISION)
+    assert cache.get("first", GRAY) is None
+    assert cache.get("third", GRAY) == DECISION
+
+
+def clustered_cache(classifier: bool, noise: float) -> RouterCache:
+    """20 embedded decisions per action around two orthogonal directions."""
+    cache = RouterCache(Path(tempfile.mkdtemp()) / "router.json", classifier=classifier)
+    rng = np.random.default_rng(0)
+    for action, axis in (("api", 0), ("rag", 1)):
+        for i in range(20):
+            vec = rng.normal(0.0, noise, 8)
+            vec[axis] += 1.0
+            cache.put(f"{action} query {i}", GRAY, {"action": action, "confidence": 0.8, "reason": ""}, vec)
+    return cache
+
+
+def test_classifier_is_off_by_default():
+    cache = clustered_cache(classifier=False, noise=0.05)
+    assert cache.classify(unit(1, 0, 0, 0, 0, 0, 0, 0)) is None
+
+
+def test_classifier_reports_held_out_agreement():
+    cache = clustered_cache(classifier=True, noise=0.05)
+    report = cache.evaluate_classifier()
+    assert report["examples"] == 40 and report["predicted"] == 40
+    assert report["agreement"] == 1.0
+    decision = cache.classify(unit(1, 0.1, 0, 0, 0, 0, 0, 0))
+    assert decision["action"] == "api" and decision["confidence"] == 1.0
+
+
+def test_classifier_defers_when_held_out_check_fails():
+    # Overlapping clusters: too few confident held-out predictions to trust it
+    cache = clustered_cache(classifier=True, noise=1.0)
+    assert cache.evaluate_classifier()["predicted"] < 20
+    assert cache.classify(unit(1, 0, 0, 0, 0, 0, 0, 0)) is None
+
+
+if __name__ == "__main__":
+    tests = [
+        test_exact_hit_ignores_case_and_punctuation,
+        test_near_duplicate_hit_by_embedding,
+        test_signal_bands_are_kept_apart,
+        test_flush_persists_and_reloads,
+        test_corrupt_files_start_empty,
+        test_lru_evicts_oldest,
+        test_classifier_is_off_by_default,
+        test_classifier_reports_held_out_agreement,
+        test_classifier_defers_when_held_out_check_fails,
+    ]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
@@ -1,6 +1,7 @@
 """API Tool: Mock external API calls for live data retrieval."""
 from __future__ import annotations
 
+import asyncio
 import json
 import random
 import time
@@ -10,6 +11,17 @@ from typing import Optional
 from langchain.tools import BaseTool
 from pydantic import Field
 
+from utils.json_codec import json_dumps, json_loads, looks_like_json_object
+
+# Shared generator for the mock data; _DAY_DELTAS[d - 1] == timedelta(days=d)
+_rng = random.Random()
+_DAY_DELTAS = tuple(timedelta(days=d) for d in range(1, 31))
+
+
+def _days(lo: int, hi: int) -> timedelta:
+    """Random whole-day offset in [lo, hi], like timedelta(days=randint(lo, hi))."""
+    return _DAY_DELTAS[_rng.randrange(lo - 1, hi)]
+
 
 class APITool(BaseTool):
     """Tool for calling external APIs to retrieve live data.
@@ -30,14 +42,17 @@ class APITool(BaseTool):
 
     def _run(self, query_info: str) -> str:
         """Execute mock API call and return live data."""
+        # Simulate API delay
+        time.sleep(self.mock_delay)
+        return self._dispatch(query_info)
+
+    def _dispatch(self, query_info: str) -> str:
+        """Parse the query and route it to the matching mock handler."""
         try:
-            # Simulate API delay
-            time.sleep(self.mock_delay)
-            
             # Parse input
-            if query_info.strip().startswith('{'):
+            if looks_like_json_object(query_info):
                 try:
-                    query = json.loads(query_info)
+                    query = json_loads(query_info)
                     query_type = query.get("query_type", "")
                     params = query.get("parameters", {})
                 except json.JSONDecodeError:
@@ -62,15 +77,16 @@ class APITool(BaseTool):
                     query_type = "unknown"
                     params = {}
             
-            # Route to appropriate mock handler
+            # Route to appropriate mock handler; all timestamps share one clock read
+            now = datetime.now()
             if query_type == "order_status":
-                result = self._mock_order_status(params)
+                result = self._mock_order_status(params, now)
             elif query_type == "inventory":
-                result = self._mock_inventory(params)
+                result = self._mock_inventory(params, now)
             elif query_type == "product_info":
-                result = self._mock_product_info(params)
+                result = self._mock_product_info(params, now)
             elif query_type == "service_status":
-                result = self._mock_service_status(params)
+                result = self._mock_service_status(params, now)
             else:
                 result = {
                     "status": "error",
@@ -78,24 +94,24 @@ class APITool(BaseTool):
                     "supported_types": ["order_status", "inventory", "product_info", "service_status"]
                 }
             
-            return json.dumps(result, ensure_ascii=False, indent=2)
+            return json_dumps(result, indent=True)
             
         except Exception as e:
-            return json.dumps({
+            return json_dumps({
                 "status": "error",
                 "message": f"API call failed: {str(e)}",
                 "timestamp": datetime.now().isoformat()
-            }, ensure_ascii=False)
+            })
 
-    def _mock_order_status(self, params: dict) -> dict:
+    def _mock_order_status(self, params: dict, now: datetime) -> dict:
         """Mock order status API."""
-        order_id = params.get("order_id", "ORD" + str(random.randint(10000, 99999)))
+        order_id = params.get("order_id", "ORD" + str(_rng.randint(10000, 99999)))
         
         statuses = ["pending", "processing", "shipped", "delivered"]
-        status = random.choice(statuses)
+        status = _rng.choice(statuses)
         
         # Generate realistic timeline
-        created_at = datetime.now() - timedelta(days=random.randint(1, 7))
+        created_at = now - _days(1, 7)
         
         result = {
             "status": "success",
@@ -117,17 +133,17 @@ class APITool(BaseTool):
                     "city": "New York",
                     "country": "USA"
                 },
-                "tracking_number": f"TRK{random.randint(100000000, 999999999)}" if status in ["shipped", "delivered"] else None,
-                "estimated_delivery": (datetime.now() + timedelta(days=random.randint(1, 5))).date().isoformat() if status != "delivered" else None
+                "tracking_number": f"TRK{_rng.randint(100000000, 999999999)}" if status in ["shipped", "delivered"] else None,
+                "estimated_delivery": (now + _days(1, 5)).date().isoformat() if status != "delivered" else None
             },
-            "timestamp": datetime.now().isoformat()
+            "timestamp": now.isoformat()
         }
         
         return result
 
-    def _mock_inventory(self, params: dict) -> dict:
+    def _mock_inventory(self, params: dict, now: datetime) -> dict:
         """Mock inventory check API."""
-        product_id = params.get("product_id", "PROD" + str(random.randint(100, 999)))
+        product_id = params.get("product_id", "PROD" + str(_rng.randint(100, 999)))
         
         result = {
             "status": "success",
@@ -135,21 +151,21 @@ class APITool(BaseTool):
             "data": {
                 "product_id": product_id,
                 "product_name": "Coffee Machine ECAM23.420",
-                "in_stock": random.choice([True, False]),
-                "quantity": random.randint(0, 100),
+                "in_stock": _rng.choice([True, False]),
+                "quantity": _rng.randint(0, 100),
                 "warehouse_locations": [
-                    {"location": "Warehouse A", "quantity": random.randint(0, 50)},
-                    {"location": "Warehouse B", "quantity": random.randint(0, 50)}
+                    {"location": "Warehouse A", "quantity": _rng.randint(0, 50)},
+                    {"location": "Warehouse B", "quantity": _rng.randint(0, 50)}
                 ],
-                "restock_date": (datetime.now() + timedelta(days=random.randint(7, 30))).date().isoformat() if random.random() < 0.3 else None,
-                "last_updated": datetime.now().isoformat()
+                "restock_date": (now + _days(7, 30)).date().isoformat() if _rng.random() < 0.3 else None,
+                "last_updated": now.isoformat()
             },
-            "timestamp": datetime.now().isoformat()
+            "timestamp": now.isoformat()
         }
         
         return result
 
-    def _mock_product_info(self, params: dict) -> dict:
+    def _mock_product_info(self, params: dict, now: datetime) -> dict:
         """Mock product information API."""
         product_id = params.get("product_id", "PROD001")
         
@@ -176,26 +192,28 @@ class APITool(BaseTool):
                 "manufacturer": "De'Longhi",
                 "warranty": "2 years"
             },
-            "timestamp": datetime.now().isoformat()
+            "timestamp": now.isoformat()
         }
         
         return result
 
-    def _mock_service_status(self, params: dict) -> dict:
+    def _mock_service_status(self, params: dict, now: datetime) -> dict:
         """Mock service status API."""
         # Simulate checking various service health
         services = {
-            "payment_gateway": random.choice(["operational", "degraded", "down"]),
-            "inventory_system": random.choice(["operational", "degraded"]),
-            "shipping_api": random.choice(["operational", "operational", "degraded"]),
+            "payment_gateway": _rng.choice(["operational", "degraded", "down"]),
+            "inventory_system": _rng.choice(["operational", "degraded"]),
+            "shipping_api": _rng.choice(["operational", "operational", "degraded"]),
             "notification_service": "operational"
         }
         
-        overall_status = "operational"
-        if "down" in services.values():
+        states = set(services.values())
+        if "down" in states:
             overall_status = "down"
-        elif "degraded" in services.values():
+        elif "degraded" in states:
             overall_status = "degraded"
+        else:
+            overall_status = "operational"
         
         result = {
             "status": "success",
@@ -203,18 +221,19 @@ class APITool(BaseTool):
             "data": {
                 "overall_status": overall_status,
                 "services": services,
-                "uptime_percentage": round(random.uniform(98.5, 99.9), 2),
-                "last_incident": (datetime.now() - timedelta(days=random.randint(1, 30))).isoformat() if random.random() < 0.3 else None,
-                "maintenance_scheduled": (datetime.now() + timedelta(days=random.randint(7, 30))).isoformat() if random.random() < 0.2 else None
+                "uptime_percentage": round(_rng.uniform(98.5, 99.9), 2),
+                "last_incident": (now - _days(1, 30)).isoformat() if _rng.random() < 0.3 else None,
+                "maintenance_scheduled": (now + _days(7, 30)).isoformat() if _rng.random() < 0.2 else None
             },
-            "timestamp": datetime.now().isoformat()
+            "timestamp": now.isoformat()
         }
         
         return result
 
     async def _arun(self, query_info: str) -> str:
-        """Async version (not implemented, falls back to sync)."""
-        return self._run(query_info)
+        """Async version: awaits the simulated delay instead of blocking the loop."""
+        await asyncio.sleep(self.mock_delay)
+        return self._dispatch(query_info)
 
 
 def create_api_tool(mock_delay: float = 0.5) -> APITool:
@@ -1,8 +1,11 @@
 """Escalate Tool: Create support ticket when RAG cannot answer."""
 from __future__ import annotations
 
+import asyncio
+import itertools
 import json
-import uuid
+import os
+import secrets
 from datetime import datetime
 from pathlib import Path
 from typing import Optional
@@ -10,6 +13,26 @@ from typing import Optional
 from langchain.tools import BaseTool
 from pydantic import Field
 
+from utils.json_codec import json_dumps, json_line, json_loads, looks_like_json_object
+
+# Ticket suffix: 6 hex digits of a per-process counter (random start, so restarts on
+# the same day don't replay ids) plus 2 random hex digits
+_ticket_seq = itertools.count(secrets.randbits(24))
+
+
+def _append_line(path: Path, line: bytes) -> None:
+    """Append one record with a single write(); O_APPEND keeps concurrent lines whole.
+
+    The log is opened per ticket (escalations are rare), so a rotated or
+    deleted log is simply recreated instead of swallowing writes.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
 
 class EscalateTool(BaseTool):
     """Tool for escalating queries to human support when RAG cannot provide answers.
@@ -34,9 +57,9 @@ class EscalateTool(BaseTool):
         """Create a support ticket and log it."""
         try:
             # Parse input (could be plain text or JSON)
-            if query_info.strip().startswith('{'):
+            if looks_like_json_object(query_info):
                 try:
-                    info = json.loads(query_info)
+                    info = json_loads(query_info)
                     query = info.get("query", query_info)
                     reason = info.get("reason", "Unable to provide confident answer")
                 except json.JSONDecodeError:
@@ -47,20 +70,19 @@ class EscalateTool(BaseTool):
                 reason = "Unable to provide confident answer"
             
             # Generate ticket
-            ticket_id = f"TICKET-{datetime.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:8].upper()}"
+            now = datetime.now()
+            ticket_id = f"TICKET-{now:%Y%m%d}-{next(_ticket_seq) & 0xFFFFFF:06X}{secrets.token_hex(1).upper()}"
             ticket = {
                 "ticket_id": ticket_id,
                 "query": query,
                 "reason": reason,
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": now.isoformat(),
                 "status": "open",
                 "assigned_to": "help_desk",
             }
             
             # Log ticket
-            self.ticket_log_path.parent.mkdir(parents=True, exist_ok=True)
-            with open(self.ticket_log_path, "a", encoding="utf-8") as f:
-                f.write(json.dumps(ticket, ensure_ascii=False) + "\n")
+            _append_line(self.ticket_log_path, json_line(ticket))
             
             # Return formatted response
             response = {
@@ -75,10 +97,10 @@ class EscalateTool(BaseTool):
                 "reason": reason,
             }
             
-            return json.dumps(response, ensure_ascii=False, indent=2)
+            return json_dumps(response, indent=True)
             
         except Exception as e:
-            return json.dumps({
+            return json_dumps({
                 "status": "error",
                 "message": f"Failed to create support ticket: {str(e)}",
                 "fallback_message": (
@@ -86,11 +108,11 @@ class EscalateTool(BaseTool):
                     "creating a support ticket. Please contact support directly at support@company.com "
                     "or call our help desk."
                 ),
-            }, ensure_ascii=False)
+            })
 
     async def _arun(self, query_info: str) -> str:
-        """Async version (not implemented, falls back to sync)."""
-        return self._run(query_info)
+        """Async version: the blocking ticket-log write runs in a worker thread."""
+        return await asyncio.to_thread(self._run, query_info)
 
 
 def create_escalate_tool(ticket_log_path: Optional[Path] = None) -> EscalateTool:
@@ -1,20 +1,30 @@
 """RAG Tool: Retrieval-Augmented Generation for answering questions."""
 from __future__ import annotations
 
-import json
-import subprocess
+import asyncio
+import queue
 import sys
+import threading
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Iterator, List, Optional, Tuple
 
+from cachetools import TTLCache
 from langchain.tools import BaseTool
-from pydantic import Field
+from pydantic import Field, PrivateAttr
 
 # Ensure project root import
 ROOT = Path(__file__).resolve().parent.parent
 if str(ROOT) not in sys.path:
     sys.path.append(str(ROOT))
 
+from utils.hybrid_retrieve import run as hybrid_run
+from utils.json_codec import json_dumps
+
+# Answered queries, keyed on normalized query text + pipeline config -> (json, answer).
+# Shared across tool instances (the app builds a new tool per question).
+_answer_cache: "TTLCache[tuple, Tuple[str, str]]" = TTLCache(maxsize=512, ttl=300)
+_answer_cache_lock = threading.Lock()
+
 
 class RAGTool(BaseTool):
     """Tool for answering questions using RAG (Retrieval-Augmented Generation).
@@ -41,94 +51,97 @@ class RAGTool(BaseTool):
     dense_model: str = Field(default="text-embedding-3-large", description="OpenAI embedding model")
     rerank_model: str = Field(default="BAAI/bge-reranker-base", description="BGE reranker model")
     chat_model: str = Field(default="gpt-5", description="Chat model for answer generation")       
+    query_embedding: Optional[List[float]] = Field(
+        default=None,
+        description="Precomputed query embedding (from dense_model) to skip re-embedding",
+    )
+
+    _last_result: Optional[str] = PrivateAttr(default=None)
+
+    @property
+    def last_result(self) -> Optional[str]:
+        """JSON result of the most recent ``_stream`` call, once it has finished."""
+        return self._last_result
+
+    def _run(self, query: str, on_token: Optional[Callable[[str], None]] = None) -> str:
+        """Execute RAG retrieval and answer generation.
+        
+        ``on_token`` receives answer text as it is generated. Answered queries
+        are reused for a few minutes; failed or unanswerable ones are not cached.
+        """
+        key = self._cache_key(query)
+        with _answer_cache_lock:
+            hit = _answer_cache.get(key)
+        if hit is not None:
+            result_json, answer = hit
+            if on_token and answer:
+                on_token(answer)
+            return result_json
 
-    def _run(self, query: str) -> str:
-        """Execute RAG retrieval and answer generation."""
         try:
-            # Call hybrid_retrieve.py as subprocess with all parameters
-            rag_args = [
-                "--query", query,
-                "--k-dense", str(self.k_dense),
-                "--k-sparse", str(self.k_sparse),
-                "--top-fuse", str(self.top_fuse),
-                "--top-rerank", str(self.top_rerank),
-                "--neighbor-radius", str(self.neighbor_radius),
-                "--max-context-tokens", str(self.max_context_tokens),
-                "--encoding", self.encoding,
-                "--dense-model", self.dense_model,
-                "--rerank-model", self.rerank_model,
-                "--chat-model", self.chat_model,
-            ]
-            
-            rag_process = subprocess.run(
-                [sys.executable, str(ROOT / "utils" / "hybrid_retrieve.py")] + rag_args,
-                capture_output=True,
-                text=True,
-                encoding="utf-8",
-                errors="ignore",
-                timeout=120,  # 120 second timeout (increased for reranker loading)
+            result = hybrid_run(
+                query,
+                k_dense=self.k_dense,
+                k_sparse=self.k_sparse,
+                top_fuse=self.top_fuse,
+                top_rerank=self.top_rerank,
+                neighbor_radius=self.neighbor_radius,
+                max_context_tokens=self.max_context_tokens,
+                encoding=self.encoding,
+                dense_model=self.dense_model,
+                rerank_model=self.rerank_model,
+                chat_model=self.chat_model,
+                query_embedding=self.query_embedding,
+                on_token=on_token,
             )
+            final = result["final"]
+            result_json = json_dumps(final)
+            if final and final.get("can_answer"):
+                with _answer_cache_lock:
+                    _answer_cache[key] = (result_json, str(final.get("answer", "")))
+            return result_json
             
-            if rag_process.returncode != 0:
-                error_msg = f"RAG process failed: {rag_process.stderr[:500]}"
-                return json.dumps({
-                    "status": "error",
-                    "message": error_msg,
-                    "can_answer": False,
-                    "confidence": 0.0
-                }, ensure_ascii=False)
-            
-            # Parse the output to extract the JSON answer
-            stdout = rag_process.stdout.strip()
-            
-            # Look for special marker FINAL_JSON_RESULT
-            if "FINAL_JSON_RESULT:" in stdout:
-                parts = stdout.split("FINAL_JSON_RESULT:")
-                if len(parts) > 1:
-                    json_part = parts[-1].split("="*80)[0].strip()
-                    try:
-                        result = json.loads(json_part)
-                        return json.dumps(result, ensure_ascii=False)
-                    except json.JSONDecodeError:
-                        pass
-            
-            # Fallback: Try to find JSON in the output (it should be at the end)
-            lines = stdout.split('\n')
-            for line in reversed(lines):
-                line = line.strip()
-                if line.startswith('{') and line.endswith('}'):
-                    try:
-                        result = json.loads(line)
-                        if "can_answer" in result or "answer" in result:
-                            return json.dumps(result, ensure_ascii=False)
-                    except json.JSONDecodeError:
-                        continue
-            
-            # If no JSON found, return the full output
-            return json.dumps({
-                "status": "success",
-                "message": stdout[-1000:],  # Last 1000 chars
-                "raw_output": True
-            }, ensure_ascii=False)
-            
-        except subprocess.TimeoutExpired:
-            return json.dumps({
-                "status": "error",
-                "message": "RAG process timed out (>60s)",
-                "can_answer": False,
-                "confidence": 0.0
-            }, ensure_ascii=False)
         except Exception as e:
-            return json.dumps({
+            return json_dumps({
                 "status": "error",
                 "message": f"Unexpected error: {str(e)}",
                 "can_answer": False,
                 "confidence": 0.0
-            }, ensure_ascii=False)
+            })
+
+    def _cache_key(self, query: str) -> tuple:
+        return (
+            " ".join(query.lower().split()),
+            self.k_dense,
+            self.k_sparse,
+            self.top_fuse,
+            self.top_rerank,
+            self.neighbor_radius,
+            self.max_context_tokens,
+            self.encoding,
+            self.dense_model,
+            self.rerank_model,
+            self.chat_model,
+        )
+
+    def _stream(self, query: str) -> Iterator[str]:
+        """Yield answer text while it is generated; the full JSON lands in ``last_result``."""
+        tokens: "queue.Queue[Optional[str]]" = queue.Queue()
+
+        def work() -> None:
+            try:
+                self._last_result = self._run(query, on_token=tokens.put)
+            finally:
+                tokens.put(None)
+
+        self._last_result = None
+        threading.Thread(target=work, daemon=True).start()
+        while (token := tokens.get()) is not None:
+            yield token
 
     async def _arun(self, query: str) -> str:
-        """Async version (not implemented, falls back to sync)."""
-        return self._run(query)
+        """Async version: the blocking retrieval/rerank pipeline runs in a worker thread."""
+        return await asyncio.to_thread(self._run, query)
 
 
 def create_rag_tool(
@@ -142,10 +155,12 @@ def create_rag_tool(
     dense_model: str = "text-embedding-3-large",
     rerank_model: str = "BAAI/bge-reranker-base",
     chat_model: str = "gpt-4o-mini",
+    query_embedding: Optional[List[float]] = None,
 ) -> RAGTool:
     """Factory function to create a configured RAG tool.
     
-    All default values match hybrid_retrieve.py for consistency.
+    All default values match hybrid_retrieve.py for consistency. Pass
+    ``query_embedding`` when the query was already embedded with ``dense_model``.
     """
     return RAGTool(
         k_dense=k_dense,
@@ -158,5 +173,6 @@ def create_rag_tool(
         dense_model=dense_model,
         rerank_model=rerank_model,
         chat_model=chat_model,
+        query_embedding=query_embedding,
     )
 
@@ -0,0 +1,155 @@
+"""BM25 Index: Okapi BM25 over chunks.jsonl, persisted as .npy arrays and memory-mapped."""
+from __future__ import annotations
+
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.json_codec import json_dumps, json_loads
+
+# Same defaults as rank_bm25.BM25Okapi (what BM25Retriever used)
+K1 = 1.5
+B = 0.75
+EPSILON = 0.25
+
+_ARRAYS = ("rows", "norm", "idf", "indptr", "doc_idx", "tf")
+
+
+def tokenize(text: str) -> List[str]:
+    """Whitespace tokens, matching BM25Retriever's default preprocessing."""
+    return text.split()
+
+
+def index_dir_for(chunks_path: Path) -> Path:
+    """Where the index for a chunks file lives (``chunks.jsonl`` -> ``chunks.bm25/``)."""
+    return chunks_path.with_suffix(".bm25")
+
+
+class BM25Index:
+    """Term-major (CSR) BM25 index; ``search`` scores only the postings of query terms.
+
+    ``rows`` maps index documents back to line numbers in the chunks file (chunks
+    with empty text are not indexed).
+    """
+
+    def __init__(self, vocab: Dict[str, int], arrays: Dict[str, np.ndarray], k1: float = K1):
+        self.vocab = vocab
+        self.k1 = k1
+        self.rows = arrays["rows"]
+        self.norm = arrays["norm"]  # k1 * (1 - b + b * doc_len / avgdl), per document
+        self.idf = arrays["idf"]
+        self.indptr = arrays["indptr"]
+        self.doc_idx = arrays["doc_idx"]
+        self.tf = arrays["tf"]
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Top-k ``(chunk row, score)`` pairs, best first."""
+        n = len(self)
+        k = min(k, n)
+        if k <= 0:
+            return []
+        scores = np.zeros(n, dtype=np.float32)
+        for term in tokenize(query):
+            tid = self.vocab.get(term)
+            if tid is None:
+                continue
+            start, end = self.indptr[tid], self.indptr[tid + 1]
+            docs = self.doc_idx[start:end]
+            tf = self.tf[start:end]
+            scores[docs] += self.idf[tid] * tf * (self.k1 + 1) / (tf + self.norm[docs])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(self.rows[i]), float(scores[i])) for i in top]
+
+
+def build_and_save(
+    chunks: List[dict],
+    out_dir: Path,
+    source: Optional[Path] = None,
+    k1: float = K1,
+    b: float = B,
+    epsilon: float = EPSILON,
+) -> None:
+    """Tokenize the chunks once and write the index arrays to ``out_dir``.
+
+    ``source`` (the chunks file) is fingerprinted so stale indexes can be detected.
+    """
+    rows: List[int] = []
+    doc_len: List[int] = []
+    vocab: Dict[str, int] = {}
+    postings: List[List[Tuple[int, int]]] = []
+    for row, chunk in enumerate(chunks):
+        text = chunk.get("text", "")
+        if not text.strip():
+            continue
+        doc = len(rows)
+        rows.append(row)
+        tokens = tokenize(text)
+        doc_len.append(len(tokens))
+        for term, count in Counter(tokens).items():
+            tid = vocab.setdefault(term, len(vocab))
+            if tid == len(postings):
+                postings.append([])
+            postings[tid].append((doc, count))
+
+    n_docs = len(rows)
+    df = np.fromiter((len(p) for p in postings), dtype=np.int64, count=len(postings))
+    indptr = np.zeros(len(postings) + 1, dtype=np.int64)
+    np.cumsum(df, out=indptr[1:])
+    flat = [pair for p in postings for pair in p]
+    doc_idx = np.fromiter((d for d, _ in flat), dtype=np.int32, count=len(flat))
+    tf = np.fromiter((c for _, c in flat), dtype=np.float32, count=len(flat))
+
+    # rank_bm25's idf: negative values are floored to epsilon * mean idf
+    idf = np.log(n_docs - df + 0.5) - np.log(df + 0.5)
+    if len(idf):
+        idf[idf < 0] = epsilon * idf.mean()
+
+    lengths = np.asarray(doc_len, dtype=np.float64)
+    avgdl = lengths.mean() if n_docs else 0.0
+    norm = k1 * (1 - b + b * lengths / avgdl) if n_docs else lengths
+
+    arrays = {
+        "rows": np.asarray(rows, dtype=np.int32),
+        "norm": norm.astype(np.float32),
+        "idf": idf.astype(np.float32),
+        "indptr": indptr,
+        "doc_idx": doc_idx,
+        "tf": tf,
+    }
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for name in _ARRAYS:
+        np.save(out_dir / f"{name}.npy", arrays[name])
+    (out_dir / "vocab.json").write_text(json_dumps(vocab), encoding="utf-8")
+    meta = {"k1": k1, "b": b, "epsilon": epsilon, "avgdl": avgdl, "n_docs": n_docs}
+    if source is not None:
+        stat = source.stat()
+        meta.update(source_mtime_ns=stat.st_mtime_ns, source_size=stat.st_size)
+    # Written last: its presence marks a complete index
+    (out_dir / "meta.json").write_text(json_dumps(meta), encoding="utf-8")
+
+
+def is_fresh(out_dir: Path, source: Path) -> bool:
+    """True if ``out_dir`` holds a complete index built from the current ``source``."""
+    meta_path = out_dir / "meta.json"
+    if not meta_path.exists():
+        return False
+    meta = json_loads(meta_path.read_bytes())
+    stat = source.stat()
+    return (
+        meta.get("source_mtime_ns") == stat.st_mtime_ns
+        and meta.get("source_size") == stat.st_size
+    )
+
+
+def load_bm25(out_dir: Path) -> BM25Index:
+    """Open a saved index; the arrays are memory-mapped and paged in on demand."""
+    meta = json_loads((out_dir / "meta.json").read_bytes())
+    vocab = json_loads((out_dir / "vocab.json").read_bytes())
+    arrays = {name: np.load(out_dir / f"{name}.npy", mmap_mode="r") for name in _ARRAYS}
+    return BM25Index(vocab, arrays, k1=meta["k1"])
@@ -1,55 +1,83 @@
 from pathlib import Path
-import json
 import sys
+from typing import Iterable, List
+
+import orjson
+import tiktoken
 from langchain_text_splitters import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
 
 # 默认源文件路径可被命令行参数覆盖
-default_src = Path(
+DEFAULT_SRC = Path(
     "data/markdown/MinerU_markdown_3d9_EN-5713226261_20251210044802_1998494870494453760.md"
 )
-src = Path(sys.argv[1]) if len(sys.argv) > 1 else default_src
-if not src.exists():
-    raise FileNotFoundError(f"源文件不存在: {src}")
+DEFAULT_OUT = Path("data/markdown/chunked/chunks.jsonl")
+# 与检索端 max_context_tokens 计数使用同一编码
+ENCODING = "cl100k_base"
+
+_enc = tiktoken.get_encoding(ENCODING)
+
 
-text = src.read_text(encoding="utf-8")
+def count_tokens(text: str) -> int:
+    return len(_enc.encode(text, disallowed_special=()))
 
+
+# 切分器构造后无状态，模块级单例，多文件切块时复用
 # 先按标题切分，提取层级元数据
 header_splitter = MarkdownHeaderTextSplitter(
     headers_to_split_on=[("#", "h1"), ("##", "h2"), ("###", "h3")]
 )
-sections = header_splitter.split_text(text)
 
-# 再做细分：512 tokens 等价的字符长度近似，重叠 200
+# 再做细分：按 token 计长，每块最多 512 tokens，重叠 100 tokens
 splitter = RecursiveCharacterTextSplitter(
     chunk_size=512,
-    chunk_overlap=200,
-    length_function=len,
+    chunk_overlap=100,
+    length_function=count_tokens,
     separators=["\n\n", "\n", " ", ""],
 )
 
-docs = []
-for sec in sections:
-    section_path = " / ".join(
-        [
-            sec.metadata.get("h1", "") or "",
-            sec.metadata.get("h2", "") or "",
-            sec.metadata.get("h3", "") or "",
-        ]
-    ).strip(" /")
-    for i, chunk in enumerate(splitter.split_text(sec.page_content)):
-        docs.append(
+
+def chunk_file(src: Path) -> List[dict]:
+    """切分单个 markdown 文件，返回 chunk 记录列表。"""
+    if not src.exists():
+        raise FileNotFoundError(f"源文件不存在: {src}")
+
+    text = src.read_text(encoding="utf-8")
+    sections = header_splitter.split_text(text)
+    source = src.name
+
+    docs = []
+    for sec in sections:
+        section_path = " / ".join(
+            [
+                sec.metadata.get("h1", "") or "",
+                sec.metadata.get("h2", "") or "",
+                sec.metadata.get("h3", "") or "",
+            ]
+        ).strip(" /")
+        # 同一 section 内不变的字段提到内层循环外
+        block_type = sec.metadata.get("block_type", "text")
+        docs.extend(
             {
                 "text": chunk,
+                "n_tokens": count_tokens(chunk),
                 "section_path": section_path,
-                "source": src.name,
+                "source": source,
                 "block_idx": i,
-                "block_type": sec.metadata.get("block_type", "text"),
+                "block_type": block_type,
             }
+            for i, chunk in enumerate(splitter.split_text(sec.page_content))
         )
+    return docs
+
+
+def write_chunks(docs: Iterable[dict], out: Path) -> None:
+    """写出 JSONL（覆盖已有文件），整体序列化后一次写入。"""
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_bytes(b"".join(orjson.dumps(d, option=orjson.OPT_APPEND_NEWLINE) for d in docs))
+
 
-out = Path("data/markdown/chunked/chunks.jsonl")
-out.parent.mkdir(parents=True, exist_ok=True)
-with out.open("w", encoding="utf-8") as f:
-    for d in docs:
-        f.write(json.dumps(d, ensure_ascii=False) + "\n")
-print(f"wrote {len(docs)} chunks -> {out}")
\ No newline at end of file
+if __name__ == "__main__":
+    src = Path(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SRC
+    docs = chunk_file(src)
+    write_chunks(docs, DEFAULT_OUT)
+    print(f"wrote {len(docs)} chunks -> {DEFAULT_OUT}")
@@ -0,0 +1,83 @@
+"""Chunks Store: Columnar Arrow sidecar for chunks.jsonl, read via memory map."""
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pyarrow as pa
+from pyarrow import feather
+
+from utils.json_codec import json_loads
+
+
+def sidecar_for(chunks_path: Path) -> Path:
+    """``chunks.jsonl`` -> ``chunks.arrow`` next to it."""
+    return chunks_path.with_suffix(".arrow")
+
+
+def load_chunks_jsonl(path: Path) -> List[dict]:
+    with path.open("rb") as f:
+        return [json_loads(line) for line in f if line.strip()]
+
+
+def _table_from_jsonl(path: Path) -> pa.Table:
+    rows = load_chunks_jsonl(path)
+    for row in rows:
+        row["chunk_id"] = f"{row['source']}:{int(row['block_idx'])}"
+    return pa.Table.from_pylist(rows)
+
+
+def jsonl_to_arrow(path_in: Path, path_out: Path) -> None:
+    """Convert chunks JSONL into an uncompressed Arrow IPC file (mmap-friendly)."""
+    table = _table_from_jsonl(path_in)
+    # Write then rename, so a reader never sees a half-written sidecar
+    tmp = path_out.with_name(path_out.name + ".tmp")
+    feather.write_feather(table, str(tmp), compression="uncompressed")
+    os.replace(tmp, path_out)
+
+
+class ChunkStore:
+    """Chunk rows backed by Arrow columns; a row becomes a dict only when it is read.
+
+    Rows are addressed by line number (``store[row]``, as BM25 hits are) or by
+    ``(source, block_idx)`` (``store.get(key)``, as neighbour lookups are).
+    Only the two key columns are turned into Python objects at load.
+    """
+
+    def __init__(self, table: pa.Table):
+        self.table = table
+        keys = zip(table.column("source").to_pylist(), table.column("block_idx").to_pylist())
+        self._row_of: Dict[Tuple[str, int], int] = {
+            (src, int(idx)): row for row, (src, idx) in enumerate(keys)
+        }
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    def __getitem__(self, row: int) -> dict:
+        return self.table.slice(row, 1).to_pylist()[0]
+
+    def get(self, key: Tuple[str, int]) -> Optional[dict]:
+        """The chunk at ``(source, block_idx)``, or None."""
+        row = self._row_of.get(key)
+        return None if row is None else self[row]
+
+    def texts(self) -> List[str]:
+        """The text column, e.g. for (re)building the BM25 index."""
+        return self.table.column("text").to_pylist()
+
+
+def load_chunks_cached(chunks_path: Path) -> ChunkStore:
+    """Open the chunks via the Arrow sidecar, (re)building it when the JSONL is newer.
+
+    Falls back to parsing the JSONL into an in-memory table if the sidecar
+    can't be written.
+    """
+    sidecar = sidecar_for(chunks_path)
+    try:
+        if not sidecar.exists() or sidecar.stat().st_mtime_ns < chunks_path.stat().st_mtime_ns:
+            jsonl_to_arrow(chunks_path, sidecar)
+    except OSError:
+        return ChunkStore(_table_from_jsonl(chunks_path))
+    return ChunkStore(feather.read_table(str(sidecar), memory_map=True))
@@ -0,0 +1,69 @@
+"""Embedding Batcher: Coalesce concurrent query embeddings into one request."""
+from __future__ import annotations
+
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Deque, List, Tuple
+
+
+class EmbeddingBatcher:
+    """Micro-batches ``embed_query`` calls into ``embed_documents`` requests.
+
+    Texts queued while an embedding call is in flight (up to ``max_batch`` of
+    them) go out together in the next call, so N concurrent queries cost a
+    few HTTP round-trips instead of N. A lone request is sent immediately;
+    only when several are already waiting does the worker hold the batch open
+    up to ``max_wait`` seconds for more to join.
+    """
+
+    def __init__(self, embedder, max_batch: int = 16, max_wait: float = 0.02):
+        """Initialize the batcher.
+
+        Args:
+            embedder: Any LangChain ``Embeddings`` (needs ``embed_documents``)
+            max_batch: Flush as soon as this many texts are queued
+            max_wait: Seconds to wait for more texts before flushing a
+                batch that already holds several
+        """
+        self.embedder = embedder
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue: Deque[Tuple[str, Future]] = deque()
+        self._cond = threading.Condition()
+        self._worker = threading.Thread(target=self._loop, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        """Queue a text for embedding; the future resolves to its vector."""
+        fut: Future = Future()
+        with self._cond:
+            self._queue.append((text, fut))
+            self._cond.notify()
+        return fut
+
+    def embed_query(self, text: str) -> List[float]:
+        """Blocking convenience wrapper matching the ``Embeddings`` API."""
+        return self.submit(text).result()
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                # Nothing is in flight here (the worker does the flushing), so a
+                # single queued text has no one to batch with: send it right away
+                if len(self._queue) > 1:
+                    self._cond.wait_for(lambda: len(self._queue) >= self.max_batch, timeout=self.max_wait)
+                batch = [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+            self._flush(batch)
+
+    def _flush(self, batch: List[Tuple[str, Future]]) -> None:
+        try:
+            vectors = self.embedder.embed_documents([text for text, _ in batch])
+        except Exception as e:
+            for _, fut in batch:
+                fut.set_exception(e)
+            return
+        for (_, fut), vec in zip(batch, vectors):
+            fut.set_result(vec)
@@ -0,0 +1,91 @@
+"""Embedding Cache: Persist embeddings on disk so repeated texts skip the API call."""
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_CACHE_PATH = Path(
+    os.getenv("RAG_EMBED_CACHE", str(Path.home() / ".cache" / "rag_embed" / "embeddings.sqlite3"))
+)
+
+# SQLite's default limit on bound parameters is 999 on older builds
+_SQL_BATCH = 500
+
+
+class CachedEmbedder(Embeddings):
+    """Wraps an ``Embeddings`` with a SQLite cache keyed on (model, text hash).
+
+    Vectors are stored as raw float32 bytes. Works for both queries and
+    documents; only the texts missing from the cache go to the wrapped embedder.
+    """
+
+    def __init__(self, underlying: Embeddings, model: str, path: Optional[Path] = None):
+        """Initialize the cache.
+
+        Args:
+            underlying: Embedder used on cache misses
+            model: Model name, part of the cache key so models never mix
+            path: SQLite file (default ``~/.cache/rag_embed/embeddings.sqlite3``)
+        """
+        self.underlying = underlying
+        self.model = model
+        path = Path(path or DEFAULT_CACHE_PATH)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB NOT NULL)"
+            )
+            self._conn.commit()
+
+    def _key(self, text: str) -> str:
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+        return f"{self.model}:{digest}"
+
+    def _get_many(self, keys: Sequence[str]) -> Dict[str, bytes]:
+        found: Dict[str, bytes] = {}
+        with self._lock:
+            for start in range(0, len(keys), _SQL_BATCH):
+                part = keys[start : start + _SQL_BATCH]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vec FROM embeddings WHERE key IN ({marks})", part
+                )
+                found.update(rows)
+        return found
+
+    def _put_many(self, items: Dict[str, List[float]]) -> None:
+        rows = [(k, np.asarray(v, dtype=np.float32).tobytes()) for k, v in items.items()]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?)", rows)
+            self._conn.commit()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(t) for t in texts]
+        found = self._get_many(list(dict.fromkeys(keys)))
+        missing = list(dict.fromkeys(k for k in keys if k not in found))
+        if missing:
+            text_for = dict(zip(keys, texts))
+            vectors = self.underlying.embed_documents([text_for[k] for k in missing])
+            fresh = dict(zip(missing, vectors))
+            self._put_many(fresh)
+            found.update((k, np.asarray(v, dtype=np.float32).tobytes()) for k, v in fresh.items())
+        return [np.frombuffer(found[k], dtype=np.float32).tolist() for k in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        blob = self._get_many([key]).get(key)
+        if blob is None:
+            vector = self.underlying.embed_query(text)
+            self._put_many({key: vector})
+            return vector
+        return np.frombuffer(blob, dtype=np.float32).tolist()
@@ -3,55 +3,77 @@ from __future__ import annotations
 
 import argparse
 import re
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 from urllib.parse import urlparse
 
 import chromadb
 import requests
+from requests.adapters import HTTPAdapter
 import torch
 from dotenv import load_dotenv
+from PIL import Image
 from langchain_experimental.open_clip import OpenCLIPEmbeddings
 
+DOWNLOAD_WORKERS = 16
+EMBED_BATCH_SIZE = 32
 
-def parse_markdown_images(md_path: Path) -> List[dict]:
-    """Extract image entries with section path and alt text."""
-    img_pattern = re.compile(r"!\[(.*?)\]\((.*?)\)")
-    header_pattern = re.compile(r"^(#{1,6})\s*(.+)")
 
+IMG_PATTERN = re.compile(r"!\[(.*?)\]\((.*?)\)")
+# Headers and images in one pass; a header match spans its whole line, so any
+# images inside the title are picked up separately with IMG_PATTERN
+MD_PATTERN = re.compile(
+    r"(?P<hdr>^(?P<level>#{1,6})[ \t]*(?P<title>.+)$)|!\[(?P<alt>.*?)\]\((?P<url>.*?)\)",
+    re.MULTILINE,
+)
+
+
+def parse_markdown_images(md_path: Path) -> Iterator[dict]:
+    """Yield image entries with section path and alt text in document order."""
     section = {"h1": "", "h2": "", "h3": ""}
-    results: List[dict] = []
-
-    with md_path.open(encoding="utf-8") as f:
-        for line in f:
-            h = header_pattern.match(line)
-            if h:
-                level = len(h.group(1))
-                title = h.group(2).strip()
-                if level == 1:
-                    section["h1"], section["h2"], section["h3"] = title, "", ""
-                elif level == 2:
-                    section["h2"], section["h3"] = title, ""
-                elif level == 3:
-                    section["h3"] = title
-
-            for m in img_pattern.finditer(line):
-                alt, url = m.groups()
-                section_path = " / ".join(
-                    [section["h1"], section["h2"], section["h3"]]
-                ).strip(" /")
-                results.append(
-                    {
-                        "url": url.strip(),
-                        "alt": alt.strip(),
-                        "section_path": section_path,
-                        "source": md_path.name,
-                    }
-                )
-    return results
 
+    def entry(alt: str, url: str) -> dict:
+        section_path = " / ".join(
+            [section["h1"], section["h2"], section["h3"]]
+        ).strip(" /")
+        return {
+            "url": url.strip(),
+            "alt": alt.strip(),
+            "section_path": section_path,
+            "source": md_path.name,
+        }
+
+    text = md_path.read_text(encoding="utf-8")
+    for m in MD_PATTERN.finditer(text):
+        if m.group("hdr") is None:
+            yield entry(m.group("alt"), m.group("url"))
+            continue
 
-def download_image(url: str, dest_dir: Path, idx: int) -> Path | None:
+        level = len(m.group("level"))
+        title = m.group("title").strip()
+        if level == 1:
+            section["h1"], section["h2"], section["h3"] = title, "", ""
+        elif level == 2:
+            section["h2"], section["h3"] = title, ""
+        elif level == 3:
+            section["h3"] = title
+        for img in IMG_PATTERN.finditer(m.group("hdr")):
+            yield entry(*img.groups())
+
+
+def make_session(pool_size: int = DOWNLOAD_WORKERS) -> requests.Session:
+    """HTTP session with a connection pool big enough for the download workers."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def download_image(
+    url: str, dest_dir: Path, idx: int, session: Optional[requests.Session] = None
+) -> Path | None:
     dest_dir.mkdir(parents=True, exist_ok=True)
     parsed = urlparse(url)
     ext = Path(parsed.path).suffix
@@ -59,15 +81,34 @@ def download_image(url: str, dest_dir: Path, idx: int) -> Path | None:
         ext = ".jpg"
     local_path = dest_dir / f"img_{idx}{ext}"
     try:
-        resp = requests.get(url, timeout=30)
-        resp.raise_for_status()
-        local_path.write_bytes(resp.content)
+        with (session or requests).get(url, timeout=30, stream=True) as resp:
+            resp.raise_for_status()
+            with local_path.open("wb") as f:
+                for block in resp.iter_content(chunk_size=64 * 1024):
+                    f.write(block)
         return local_path
     except Exception as e:
         print(f"failed to download {url}: {e}")
         return None
 
 
+def _preprocess(embedder: OpenCLIPEmbeddings, path: Path) -> torch.Tensor:
+    # Close the file right after decoding instead of leaving it to the GC
+    with Image.open(path) as im:
+        return embedder.preprocess(im)
+
+
+def embed_image_batch(embedder: OpenCLIPEmbeddings, paths: List[Path]) -> List[List[float]]:
+    """Encode a batch of images in one forward pass (embed_image loops per image)."""
+    param = next(embedder.model.parameters())
+    pixels = torch.stack([_preprocess(embedder, p) for p in paths])
+    pixels = pixels.to(device=param.device, dtype=param.dtype)
+    with torch.inference_mode():
+        feats = embedder.model.encode_image(pixels)
+        feats = feats / feats.norm(p=2, dim=-1, keepdim=True)
+    return feats.float().cpu().tolist()
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="Embed markdown images into Chroma")
     parser.add_argument(
@@ -106,18 +147,32 @@ def main() -> None:
 
     device = "cuda" if torch.cuda.is_available() else "cpu"
     print(f"using device: {device}")
+    if device == "cuda":
+        # Fixed input size, so let cuDNN pick the fastest conv kernels once
+        torch.backends.cudnn.benchmark = True
+
+    # Downloads are network-bound: fetch them concurrently over one pooled session,
+    # starting as soon as the first image line is parsed
+    session = make_session()
+
+    # The same image is often referenced from several sections: download (and later
+    # embed) each URL once, keeping every reference for the metadata fan-out
+    refs: Dict[str, List[dict]] = {}
+    futures: List[Tuple[str, Future]] = []
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as ex:
+        for entry in parse_markdown_images(args.markdown_path):
+            url = entry["url"]
+            if url not in refs:
+                refs[url] = []
+                futures.append(
+                    (url, ex.submit(download_image, url, args.images_dir, len(futures), session))
+                )
+            refs[url].append(entry)
+        results = [(url, fut.result()) for url, fut in futures]
+    found = sum(len(entries) for entries in refs.values())
+    downloaded: List[Tuple[str, Path]] = [(url, local) for url, local in results if local]
 
-    entries = parse_markdown_images(args.markdown_path)
-    print(f"found {len(entries)} images in markdown")
-    if not entries:
-        return
-
-    downloaded: List[Tuple[dict, Path]] = []
-    for idx, entry in enumerate(entries):
-        local = download_image(entry["url"], args.images_dir, idx)
-        if local:
-            downloaded.append((entry, local))
-
+    print(f"found {found} images in markdown ({len(refs)} unique)")
     print(f"downloaded {len(downloaded)} images")
     if not downloaded:
         return
@@ -127,6 +182,10 @@ def main() -> None:
         checkpoint="laion2b_s34b_b79k",
         device=device,
     )
+    if device == "cuda":
+        # Half precision doubles throughput on the GPU; vectors are cast back to
+        # float32 before they are written to Chroma. CPU stays in FP32.
+        embedder.model.to(device).half()
 
     chroma_client = chromadb.PersistentClient(path=str(args.persist_path))
     collection = chroma_client.get_or_create_collection(args.collection)
@@ -137,25 +196,37 @@ def main() -> None:
     valid_ids = []
     valid_vecs = []
     valid_metas = []
-    for i, (entry, path) in enumerate(downloaded):
+    for start in range(0, len(downloaded), EMBED_BATCH_SIZE):
+        batch = downloaded[start : start + EMBED_BATCH_SIZE]
         try:
-            vec = embedder.embed_image([str(path)])[0]
+            vecs = embed_image_batch(embedder, [path for _, path in batch])
         except Exception as e:
-            print(f"failed to embed {path}: {e}")
-            continue
-
-        valid_ids.append(f"img-{i}")
-        valid_vecs.append(vec)
-        valid_metas.append(
-            {
-                "section_path": entry.get("section_path", ""),
-                "source": entry.get("source", ""),
-                "url": entry.get("url", ""),
-                "alt": entry.get("alt", ""),
-                "local_path": str(path),
-                "block_type": "image",
-            }
-        )
+            # Fall back to one-by-one so a single bad file only skips itself
+            print(f"batch embed failed ({e}), retrying images individually")
+            vecs = []
+            for _, path in batch:
+                try:
+                    vecs.append(embed_image_batch(embedder, [path])[0])
+                except Exception as e:
+                    print(f"failed to embed {path}: {e}")
+                    vecs.append(None)
+
+        for (url, path), vec in zip(batch, vecs):
+            if vec is None:
+                continue
+            for entry in refs[url]:
+                valid_ids.append(f"img-{len(valid_ids)}")
+                valid_vecs.append(vec)
+                valid_metas.append(
+                    {
+                        "section_path": entry.get("section_path", ""),
+                        "source": entry.get("source", ""),
+                        "url": url,
+                        "alt": entry.get("alt", ""),
+                        "local_path": str(path),
+                        "block_type": "image",
+                    }
+                )
 
     if not valid_ids:
         print("no valid embeddings to upsert")
@@ -4,28 +4,44 @@ from __future__ import annotations
 import argparse
 import json
 import os
+import sys
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
 from pathlib import Path
-from typing import Iterator, List
+from typing import Deque, Iterable, Iterator, List, Tuple
+
+# Ensure project root is on sys.path so that `utils.*` works when run as a script.
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
 
 import chromadb
+import numpy as np
 from dotenv import load_dotenv
 from langchain_openai import OpenAIEmbeddings
 
+from utils import faiss_store
+from utils.embed_cache import CachedEmbedder
+
+# (ids, documents, metadatas) for one upsert batch
+Batch = Tuple[List[str], List[str], List[dict]]
+
 
-def batched(items: List[dict], batch_size: int) -> Iterator[List[dict]]:
-    for i in range(0, len(items), batch_size):
-        yield items[i : i + batch_size]
+def batched(items: Iterable[dict], batch_size: int) -> Iterator[List[dict]]:
+    it = iter(items)
+    while batch := list(islice(it, batch_size)):
+        yield batch
 
 
-def load_chunks(path: Path) -> List[dict]:
-    data: List[dict] = []
+def iter_chunks(path: Path) -> Iterator[dict]:
+    """Stream chunks from JSONL so only the in-flight batches are held in memory."""
     with path.open(encoding="utf-8") as f:
         for line in f:
             line = line.strip()
             if not line:
                 continue
-            data.append(json.loads(line))
-    return data
+            yield json.loads(line)
 
 
 def main() -> None:
@@ -50,9 +66,15 @@ def main() -> None:
     parser.add_argument(
         "--batch-size",
         type=int,
-        default=64,
+        default=256,
         help="Batch size for embedding requests",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Number of embedding requests kept in flight concurrently",
+    )
     parser.add_argument(
         "--model",
         default="text-embedding-3-large",
@@ -69,9 +91,6 @@ def main() -> None:
     if not os.getenv("OPENAI_API_KEY"):
         raise RuntimeError("Missing OPENAI_API_KEY")
 
-    chunks = load_chunks(args.chunks_path)
-    print(f"loaded {len(chunks)} chunks from {args.chunks_path}")
-
     chroma_client = chromadb.PersistentClient(path=str(args.persist_path))
     collection = chroma_client.get_or_create_collection(args.collection)
 
@@ -79,34 +98,58 @@ def main() -> None:
         collection.delete(where={"source": args.delete_source})
         print(f"deleted existing docs with source={args.delete_source}")
 
-    # LangChain OpenAI embeddings (env var OPENAI_API_KEY / AZURE settings)
-    embeddings = OpenAIEmbeddings(model=args.model)
+    # LangChain OpenAI embeddings (env var OPENAI_API_KEY / AZURE settings); unchanged
+    # chunks are served from the on-disk cache when re-indexing
+    embeddings = CachedEmbedder(OpenAIEmbeddings(model=args.model), args.model)
 
     total = 0
-    for batch in batched(chunks, args.batch_size):
-        texts = [d["text"] for d in batch]
-        ids = [f'text-{d.get("block_idx", i)}-{i}' for i, d in enumerate(batch, start=total)]
-        metas = [
-            {
-                "section_path": d.get("section_path", ""),
-                "source": d.get("source", ""),
-                "block_idx": d.get("block_idx", -1),
-                "block_type": d.get("block_type", "text"),
-            }
-            for d in batch
-        ]
-
-        vectors = embeddings.embed_documents(texts)
 
+    def embed(texts: List[str]) -> np.ndarray:
+        # One float32 matrix per batch, built in the worker thread, so Chroma
+        # gets an ndarray instead of re-validating nested Python lists
+        return np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+
+    def upsert(batch: Batch, vectors: np.ndarray) -> None:
+        nonlocal total
+        ids, texts, metas = batch
         collection.upsert(
             ids=ids,
             embeddings=vectors,
             documents=texts,
             metadatas=metas,
         )
-        total += len(batch)
-        print(f"upserted {total}/{len(chunks)}")
-
+        total += len(ids)
+        print(f"upserted {total}")
+
+    # Keep up to `workers` embedding requests in flight; upsert finished batches in order
+    pending: Deque[Tuple[Batch, Future]] = deque()
+    offset = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as ex:
+        for chunk_batch in batched(iter_chunks(args.chunks_path), args.batch_size):
+            ids = [f'text-{d.get("block_idx", i)}-{i}' for i, d in enumerate(chunk_batch, start=offset)]
+            texts = [d["text"] for d in chunk_batch]
+            metas = [
+                {
+                    "section_path": d.get("section_path", ""),
+                    "source": d.get("source", ""),
+                    "block_idx": d.get("block_idx", -1),
+                    "block_type": d.get("block_type", "text"),
+                }
+                for d in chunk_batch
+            ]
+            offset += len(chunk_batch)
+            pending.append(((ids, texts, metas), ex.submit(embed, texts)))
+            if len(pending) >= args.workers:
+                batch, fut = pending.popleft()
+                upsert(batch, fut.result())
+        while pending:
+            batch, fut = pending.popleft()
+            upsert(batch, fut.result())
+
+    # The retriever's int8 FAISS copy is rebuilt from the collection on next load
+    faiss_store.invalidate(faiss_store.index_dir_for(args.persist_path, args.collection))
+
+    print(f"embedded {total} chunks from {args.chunks_path}")
     print(
         f"done. collection={args.collection}, size={collection.count()}, persisted at {args.persist_path}"
     )
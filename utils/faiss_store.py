@@ -0,0 +1,142 @@
+"""FAISS Store: int8 (SQ8) HNSW copy of a Chroma collection for dense search."""
+from __future__ import annotations
+
+import time
+from pathlib import Path
+from typing import Optional, Sequence
+
+import faiss
+import numpy as np
+import pyarrow as pa
+from pyarrow import feather
+
+from utils.json_codec import json_dumps, json_loads
+
+HNSW_M = 32
+EF_SEARCH = 64
+
+
+def index_dir_for(persist_path: Path, collection_name: str) -> Path:
+    """Where the SQ8 index for a collection lives (``chroma_db/<name>.faiss/``)."""
+    return Path(persist_path) / f"{collection_name}.faiss"
+
+
+class FaissStore:
+    """float32 queries against an 8-bit scalar-quantized HNSW index.
+
+    ``query`` mirrors ``chromadb.Collection.query`` so the store can stand in
+    for the collection in ``dense_search``. Distances are
+    squared L2, as with Chroma's default space.
+    """
+
+    def __init__(self, index: "faiss.Index", table: pa.Table):
+        self.index = index
+        self.table = table  # id / document / metadata (JSON) per row, memory-mapped
+
+    def __len__(self) -> int:
+        return self.index.ntotal
+
+    def query(
+        self,
+        query_embeddings: Sequence[Sequence[float]],
+        n_results: int,
+        include: Sequence[str] = ("documents", "metadatas", "distances"),
+    ) -> dict:
+        xq = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        # HNSW only returns up to efSearch neighbours
+        self.index.hnsw.efSearch = max(EF_SEARCH, n_results)
+        dists, rows = self.index.search(xq, min(n_results, len(self)))
+        res = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for drow, rrow in zip(dists, rows):
+            keep = rrow >= 0
+            picked = self.table.take(pa.array(rrow[keep]))
+            res["ids"].append(picked.column("id").to_pylist())
+            res["documents"].append(picked.column("document").to_pylist())
+            res["metadatas"].append([json_loads(m) for m in picked.column("metadata").to_pylist()])
+            res["distances"].append(drow[keep].tolist())
+        return {key: val for key, val in res.items() if key == "ids" or key in include}
+
+
+def build_and_save(collection, out_dir: Path, m: int = HNSW_M) -> int:
+    """Export ``collection`` and write its SQ8 HNSW index to ``out_dir``.
+
+    The collection's record count and the source version (see ``invalidate``)
+    are stored so stale indexes can be detected. Returns the number of vectors
+    indexed; an empty collection writes no index and returns 0.
+    """
+    (out_dir / "meta.json").unlink(missing_ok=True)
+    # Read before the export: a collection write during the build bumps the
+    # version again, leaving this index stale rather than silently outdated
+    version = _source_version(out_dir)
+    rows = collection.get(include=["embeddings", "documents", "metadatas"])
+    if not rows["ids"]:
+        return 0
+    xb = np.ascontiguousarray(rows["embeddings"], dtype=np.float32)
+    n, d = xb.shape
+    index = faiss.IndexHNSWSQ(d, faiss.ScalarQuantizer.QT_8bit, m)
+    # SQ8 training only learns the per-dimension value ranges
+    index.train(xb)
+    index.add(xb)
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    faiss.write_index(index, str(out_dir / "index.faiss"))
+    table = pa.table(
+        {
+            "id": rows["ids"],
+            "document": rows["documents"],
+            "metadata": [json_dumps(meta or {}) for meta in rows["metadatas"]],
+        }
+    )
+    feather.write_feather(table, str(out_dir / "rows.arrow"), compression="uncompressed")
+    meta = {"count": n, "dim": d, "m": m, "source_version": version, "built_ns": time.time_ns()}
+    # Written last: its presence marks a complete index
+    (out_dir / "meta.json").write_text(json_dumps(meta), encoding="utf-8")
+    return n
+
+
+def index_version(out_dir: Path, collection) -> Optional[int]:
+    """Build time (``built_ns``) of the index in ``out_dir`` if it is fresh, else None.
+
+    Fresh means complete, built after the last ``invalidate`` and holding the
+    collection's current record count. Cheap enough to check on every query.
+    """
+    meta_path = out_dir / "meta.json"
+    if not meta_path.exists():
+        return None
+    meta = json_loads(meta_path.read_bytes())
+    if meta.get("source_version", 0) != _source_version(out_dir):
+        return None
+    if meta.get("count") != collection.count():
+        return None
+    return meta.get("built_ns", 0)
+
+
+def is_fresh(out_dir: Path, collection) -> bool:
+    """True if ``out_dir`` holds an index that matches the collection (see ``index_version``)."""
+    return index_version(out_dir, collection) is not None
+
+
+def invalidate(out_dir: Path) -> None:
+    """Mark the index stale after the collection was written to.
+
+    Bumps the source version every build records, so readers in any process
+    see the index as stale even when the record count did not change (ids
+    re-embedded in place).
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    (out_dir / "source_version").write_text(str(time.time_ns()), encoding="utf-8")
+    (out_dir / "meta.json").unlink(missing_ok=True)
+
+
+def _source_version(out_dir: Path) -> int:
+    try:
+        return int((out_dir / "source_version").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return 0
+
+
+def load_store(out_dir: Path) -> FaissStore:
+    """Open a saved index; the row table is memory-mapped."""
+    index = faiss.read_index(str(out_dir / "index.faiss"))
+    table = feather.read_table(str(out_dir / "rows.arrow"), memory_map=True)
+    return FaissStore(index, table)
@@ -2,11 +2,17 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
 import json
 import os
+import re
 import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
 # Ensure project root is on sys.path so that `utils.*` works when run as a script.
 ROOT = Path(__file__).resolve().parent.parent
@@ -14,142 +20,143 @@ if str(ROOT) not in sys.path:
     sys.path.append(str(ROOT))
 
 import chromadb
+import numpy as np
 from dotenv import load_dotenv
-from FlagEmbedding import FlagReranker
-from langchain_community.retrievers import BM25Retriever
-from langchain_core.documents import Document
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from tiktoken import get_encoding
+from tiktoken import Encoding, get_encoding
 
+from utils.embed_cache import CachedEmbedder
+from utils.chunks_store import ChunkStore, load_chunks_cached
+from utils.bm25_index import BM25Index, build_and_save, index_dir_for, is_fresh, load_bm25
+from utils import faiss_store
+from utils.rerank import get_reranker, rerank_bge
 from utils.prompt_config import (
     build_messages_answer,
     build_messages_judge,
 )
-from utils.llm_answer import generate_answer
+from utils.llm_answer import generate_answer, stream_answer
+from utils.json_codec import json_dumps, json_loads_llm
 
+DEFAULT_CHUNKS_PATH = Path("data/markdown/chunked/chunks.jsonl")
+# Encoding of the n_tokens counts that utils/chunker.py stores on each chunk
+CHUNK_TOKEN_ENCODING = "cl100k_base"
 
-def load_chunks(path: Path) -> List[dict]:
-    data: List[dict] = []
-    with path.open(encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                data.append(json.loads(line))
-    return data
+# Load environment variables once at import rather than on every run()
+load_dotenv()
+
+
+@dataclass(slots=True)
+class Hit:
+    """One retrieved chunk as it moves through search, fusion, rerank and dedup."""
+
+    doc_id: str
+    score: float  # meaning depends on the stage (similarity, RRF, rerank)
+    meta: Dict
+    doc: str
+
+
+# Shared by run() to overlap the sparse side with the query embedding + Chroma query
+_SEARCH_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid-search")
+# Background (re)builds of the FAISS copies, and the loaded (built_ns, store) per
+# (persist_path, collection); see get_dense_store
+_INDEX_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="faiss-build")
+_DENSE_LOCK = threading.Lock()
+_DENSE_BUILDS: Dict[Tuple[str, str], Future] = {}
+_DENSE_STORES: Dict[Tuple[str, str], Tuple[int, faiss_store.FaissStore]] = {}
+
+
+def load_chunks(path: Path) -> ChunkStore:
+    """Chunks from the memory-mapped Arrow sidecar of the JSONL (see chunks_store)."""
+    return load_chunks_cached(path)
 
 
 def dense_search(
     collection, query_vec: List[float], k: int
-) -> List[Tuple[str, float, Dict, str]]:
+) -> List[Hit]:
     res = collection.query(
         query_embeddings=[query_vec],
         n_results=k,
         include=["documents", "metadatas", "distances"],
     )
-    hits = []
-    for doc_id, meta, dist, doc in zip(
-        res["ids"][0], res["metadatas"][0], res["distances"][0], res["documents"][0]
-    ):
-        # Convert distance to score; smaller dist -> higher score
-        score = 1.0 / (1.0 + dist)
-        hits.append((doc_id, score, meta, doc))
-    return hits
+    # Convert distance to score; smaller dist -> higher score
+    scores = 1.0 / (1.0 + np.asarray(res["distances"][0], dtype=np.float64))
+    return list(map(Hit, res["ids"][0], scores.tolist(), res["metadatas"][0], res["documents"][0]))
 
 
-def build_bm25(chunks: List[dict]) -> BM25Retriever:
-    docs = [
-        Document(page_content=d["text"], metadata=d)
-        for d in chunks
-        if d.get("text", "").strip()
-    ]
-    retriever = BM25Retriever.from_documents(docs)
-    return retriever
+def build_bm25(chunks: ChunkStore, chunks_path: Path) -> BM25Index:
+    """Open the persisted BM25 index for ``chunks_path``, rebuilding it if stale."""
+    index_dir = index_dir_for(chunks_path)
+    if not is_fresh(index_dir, chunks_path):
+        # Only a rebuild reads the whole text column
+        build_and_save([{"text": text} for text in chunks.texts()], index_dir, source=chunks_path)
+    return load_bm25(index_dir)
 
 
 def sparse_search(
-    retriever: BM25Retriever, query: str, k: int
-) -> List[Tuple[str, float, Dict, str]]:
-    # 兼容当前版本：使用 runnable 接口 invoke 获取文档
-    docs = retriever.invoke(query)
+    bm25: BM25Index, chunks: ChunkStore, query: str, k: int
+) -> List[Hit]:
     hits = []
-    for i, doc in enumerate(docs[:k]):
-        meta = doc.metadata
+    for i, (row, _score) in enumerate(bm25.search(query, k)):
+        meta = chunks[row]
         doc_id = f"bm25-{meta.get('source','')}-{meta.get('block_idx', i)}"
-        hits.append((doc_id, float(k - i), meta, doc.page_content))
+        hits.append(Hit(doc_id, float(k - i), meta, meta["text"]))
     return hits
 
 
 def rrf_fuse(
-    dense_hits: List[Tuple[str, float, Dict, str]],
-    sparse_hits: List[Tuple[str, float, Dict, str]],
+    dense_hits: List[Hit],
+    sparse_hits: List[Hit],
     k: int = 60,
     top_n: int = 50,
-) -> List[Tuple[str, float, Dict, str]]:
-    pool: Dict[str, Tuple[float, Dict, str]] = {}
+) -> List[Hit]:
+    # Map doc ids to slots once; meta/doc of the last occurrence win, as before
+    slot: Dict[str, int] = {}
+    ids: List[str] = []
+    records: List[Hit] = []
+    scores = np.zeros(len(dense_hits) + len(sparse_hits))
     for hits in (dense_hits, sparse_hits):
-        for rank, (doc_id, score, meta, doc) in enumerate(hits, start=1):
-            contrib = 1.0 / (k + rank)
-            if doc_id not in pool:
-                pool[doc_id] = (contrib, meta, doc)
+        idx = np.empty(len(hits), dtype=np.intp)
+        for rank, hit in enumerate(hits):
+            i = slot.setdefault(hit.doc_id, len(ids))
+            if i == len(ids):
+                ids.append(hit.doc_id)
+                records.append(hit)
             else:
-                pool[doc_id] = (pool[doc_id][0] + contrib, meta, doc)
-    fused = sorted(pool.items(), key=lambda x: x[1][0], reverse=True)
-    return [(doc_id, sc_meta_doc[0], sc_meta_doc[1], sc_meta_doc[2]) for doc_id, sc_meta_doc in fused[:top_n]]
-
-
-def rerank_bge(
-    reranker: FlagReranker,
-    query: str,
-    candidates: List[Tuple[str, float, Dict, str]],
-    top_n: int = 8,
-) -> List[Tuple[str, float, Dict, str]]:
-    if not candidates:
-        return []
-    pairs = [[query, doc] for _, _, _, doc in candidates]
-    scores = reranker.compute_score(pairs, normalize=True)
-    reranked = []
-    for (doc_id, _, meta, doc), sc in zip(candidates, scores):
-        reranked.append((doc_id, float(sc), meta, doc))
-    reranked.sort(key=lambda x: x[1], reverse=True)
-    return reranked[:top_n]
+                records[i] = hit
+            idx[rank] = i
+        np.add.at(scores, idx, 1.0 / (k + np.arange(1, len(hits) + 1)))
+    scores = scores[: len(ids)]
+    # Stable sort keeps first-seen order among equal scores (dense and sparse hits
+    # at the same rank tie exactly); the pool is small, so a full sort is cheap
+    order = np.argsort(-scores, kind="stable")[:top_n]
+    return [Hit(ids[i], float(scores[i]), records[i].meta, records[i].doc) for i in order]
 
 
 def dedup_results(
-    items: List[Tuple[str, float, Dict, str]]
-) -> List[Tuple[str, float, Dict, str]]:
-    seen = set()
-    uniq = []
-    for doc_id, sc, meta, doc in items:
-        key = (meta.get("source", ""), meta.get("block_idx", -1))
-        if key in seen:
-            continue
-        seen.add(key)
-        uniq.append((doc_id, sc, meta, doc))
-    return uniq
-
-
-def load_chunk_map(chunks: List[dict]) -> Dict[Tuple[str, int], dict]:
-    mp: Dict[Tuple[str, int], dict] = {}
-    for c in chunks:
-        key = (c["source"], int(c["block_idx"]))
-        c["chunk_id"] = f"{c['source']}:{int(c['block_idx'])}"
-        mp[key] = c
-    return mp
+    items: List[Hit]
+) -> List[Hit]:
+    """Drop repeated (source, block_idx) hits, keeping the first of each in order."""
+    keys = [(hit.meta.get("source", ""), hit.meta.get("block_idx", -1)) for hit in items]
+    # Built from the reversed lists, so each key ends up mapped to its first hit
+    first = dict(zip(reversed(keys), reversed(items)))
+    return [first[key] for key in dict.fromkeys(keys)]
 
 
 def collect_with_neighbors(
-    top_hits: List[Tuple[str, float, Dict, str]],
-    chunk_map: Dict[Tuple[str, int], dict],
+    top_hits: List[Hit],
+    chunk_map: ChunkStore,
     radius: int = 1,
     max_tokens: int = 1500,
     encoder_name: str = "cl100k_base",
 ) -> List[Tuple[str, str]]:
     """Collect hit chunks with neighbor blocks in the same section, limited by tokens."""
-    enc = get_encoding(encoder_name)
+    # Pick the candidate blocks first, then count tokens: chunks carry their
+    # n_tokens from the chunker, and only those without one are tokenized (in
+    # one batch call)
     seen = set()
-    collected: List[Tuple[str, str]] = []
-    total_tokens = 0
-    for _, _, meta, _doc in top_hits:
+    candidates: List[Tuple[str, str, Optional[int]]] = []
+    for hit in top_hits:
+        meta = hit.meta
         src = meta.get("source", "")
         bi = int(meta.get("block_idx", -1))
         sec = meta.get("section_path", "")
@@ -158,9 +165,6 @@ def collect_with_neighbors(
             if key in seen:
                 continue
             chunk = chunk_map.get(key)
-            if not chunk:
-                # Fallback: try string key if any
-                chunk = chunk_map.get((src, int(nb)))
             if not chunk:
                 continue
             if chunk.get("section_path", "") != sec:
@@ -168,32 +172,383 @@ def collect_with_neighbors(
             text = chunk.get("text", "")
             if not text:
                 continue
-            token_len = len(enc.encode(text))
-            if total_tokens + token_len > max_tokens:
-                # Truncate the remaining space
-                remaining_tokens = max_tokens - total_tokens
-                if remaining_tokens > 0:
-                    truncated = enc.decode(enc.encode(text)[:remaining_tokens])
-                    collected.append((chunk.get("chunk_id", f"{src}:{nb}"), truncated))
-                return collected
-            collected.append((chunk.get("chunk_id", f"{src}:{nb}"), text))
-            total_tokens += token_len
+            n_tokens = chunk.get("n_tokens") if encoder_name == CHUNK_TOKEN_ENCODING else None
+            candidates.append((chunk.get("chunk_id", f"{src}:{nb}"), text, n_tokens))
             seen.add(key)
+    if not candidates:
+        return []
+
+    enc = get_encoder(encoder_name)
+    counts = [n for _, _, n in candidates]
+    missing = [i for i, n in enumerate(counts) if n is None]
+    if missing:
+        token_lists = enc.encode_batch(
+            [candidates[i][1] for i in missing], num_threads=os.cpu_count() or 8
+        )
+        for i, tokens in zip(missing, token_lists):
+            counts[i] = len(tokens)
+    collected: List[Tuple[str, str]] = []
+    total_tokens = 0
+    for (cid, text, _), n_tokens in zip(candidates, counts):
+        if total_tokens + n_tokens > max_tokens:
+            # Truncate the remaining space
+            remaining_tokens = max_tokens - total_tokens
+            if remaining_tokens > 0:
+                collected.append((cid, enc.decode(enc.encode(text)[:remaining_tokens])))
+            return collected
+        collected.append((cid, text))
+        total_tokens += n_tokens
     return collected
 
 
+_JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class JSONFieldStreamer:
+    """Incrementally decode one string field out of a JSON object being streamed.
+
+    ``feed`` takes the next raw chunk of model output and returns whatever new
+    text of the field's value became decodable, so the answer can be shown
+    while the rest of the JSON (sources, confidence) is still being generated.
+    """
+
+    def __init__(self, field: str):
+        self._start_re = re.compile(r'"' + re.escape(field) + r'"\s*:\s*"')
+        self._buf = ""
+        self._pos = -1  # index of the next undecoded char of the value, -1 until found
+        self._done = False
+
+    def feed(self, piece: str) -> str:
+        self._buf += piece
+        if self._done:
+            return ""
+        if self._pos < 0:
+            m = self._start_re.search(self._buf)
+            if not m:
+                return ""
+            self._pos = m.end()
+        out = []
+        buf, i = self._buf, self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if ch == '"':
+                self._done = True
+                break
+            if ch != "\\":
+                out.append(ch)
+                i += 1
+                continue
+            # Escape sequence: wait for the rest of it if it is split across chunks
+            if i + 1 >= len(buf):
+                break
+            if buf[i + 1] == "u":
+                if i + 6 > len(buf):
+                    break
+                code = int(buf[i + 2 : i + 6], 16)
+                if 0xD800 <= code < 0xDC00:
+                    # High surrogate: join it with the \uXXXX low half that should follow
+                    if i + 8 > len(buf):
+                        break
+                    if buf[i + 6 : i + 8] == "\\u":
+                        if i + 12 > len(buf):
+                            break
+                        low = int(buf[i + 8 : i + 12], 16)
+                        if 0xDC00 <= low < 0xE000:
+                            out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                            i += 12
+                            continue
+                    code = 0xFFFD
+                elif 0xDC00 <= code < 0xE000:
+                    code = 0xFFFD  # Lone low surrogate
+                out.append(chr(code))
+                i += 6
+            else:
+                out.append(_JSON_ESCAPES.get(buf[i + 1], buf[i + 1]))
+                i += 2
+        self._pos = i
+        return "".join(out)
+
+
+def _is_complete_json(text: str) -> bool:
+    try:
+        json_loads_llm(text)
+    except json.JSONDecodeError:
+        return False
+    return True
+
+
+@lru_cache(maxsize=4)
+def get_encoder(name: str) -> Encoding:
+    """Resolve a tiktoken encoding once per name per process."""
+    return get_encoding(name)
+
+
+@lru_cache(maxsize=4)
+def get_embedder(model: str) -> CachedEmbedder:
+    """Build the query embedder once per model per process (disk-cached vectors)."""
+    return CachedEmbedder(OpenAIEmbeddings(model=model), model)
+
+
+@lru_cache(maxsize=4)
+def get_collection(persist_path: str, name: str):
+    """Open a persisted Chroma collection once per process."""
+    return chromadb.PersistentClient(path=persist_path).get_collection(name)
+
+
+def get_dense_store(persist_path: str, name: str):
+    """The SQ8 FAISS copy of a Chroma collection, or the collection itself until it is ready.
+
+    Freshness is re-checked on every call, so an index invalidated by another
+    process (embed_text_chroma) is noticed. A missing or stale index is
+    rebuilt in the background while the Chroma collection, which has the same
+    ``query`` API, serves dense search.
+    """
+    collection = get_collection(persist_path, name)
+    index_dir = faiss_store.index_dir_for(Path(persist_path), name)
+    version = faiss_store.index_version(index_dir, collection)
+    key = (persist_path, name)
+    if version is None:
+        # Nothing to index in an empty collection
+        if collection.count():
+            _schedule_dense_build(key, collection, index_dir)
+        return collection
+    with _DENSE_LOCK:
+        loaded = _DENSE_STORES.get(key)
+        if loaded is None or loaded[0] != version:
+            loaded = (version, faiss_store.load_store(index_dir))
+            _DENSE_STORES[key] = loaded
+    return loaded[1]
+
+
+def _schedule_dense_build(key: Tuple[str, str], collection, index_dir: Path) -> None:
+    with _DENSE_LOCK:
+        if key in _DENSE_BUILDS:
+            return
+        future = _INDEX_POOL.submit(faiss_store.build_and_save, collection, index_dir)
+        _DENSE_BUILDS[key] = future
+
+    def done(fut) -> None:
+        with _DENSE_LOCK:
+            _DENSE_BUILDS.pop(key, None)
+        if fut.exception() is not None:
+            print(f"FAISS index build failed for {key[1]}: {fut.exception()}", file=sys.stderr)
+
+    future.add_done_callback(done)
+
+
+@lru_cache(maxsize=4)
+def load_bm25_index(chunks_path: Path) -> Tuple[BM25Index, ChunkStore]:
+    """Open the chunks and their BM25 index once per process."""
+    chunks = load_chunks(chunks_path)
+    return build_bm25(chunks, chunks_path), chunks
+
+
 def build_prompt(query: str, context_chunks: List[str]) -> List[dict]:
     # Kept for backward compatibility; delegate to shared prompt builder
     return build_messages(query, context_chunks, language="English")
 
 
+def run(
+    query: str,
+    chunks_path: Path = DEFAULT_CHUNKS_PATH,
+    persist_path: Path = Path("chroma_db"),
+    collection_name: str = "coffee_text",
+    k_dense: int = 40,
+    k_sparse: int = 40,
+    top_fuse: int = 40,
+    top_rerank: int = 6,
+    neighbor_radius: int = 2,
+    max_context_tokens: int = 3000,
+    encoding: str = "cl100k_base",
+    dense_model: str = "text-embedding-3-large",
+    rerank_model: str = "BAAI/bge-reranker-base",
+    chat_model: str = "gpt-4o-mini",
+    no_llm: bool = False,
+    query_embedding: Optional[List[float]] = None,
+    on_token: Optional[Callable[[str], None]] = None,
+) -> dict:
+    """Run the full retrieval (+ optional answer/judge) pipeline in-process.
+
+    Returns a dict with the intermediate hits, the collected context and, unless
+    ``no_llm`` is set, the raw LLM/judge outputs plus the parsed ``final`` result.
+    Pass ``query_embedding`` (from ``dense_model``) to skip re-embedding the query,
+    and ``on_token`` to receive the answer text incrementally while it is generated.
+    """
+    if not os.getenv("OPENAI_API_KEY"):
+        raise RuntimeError("Missing OPENAI_API_KEY")
+
+    # Sparse BM25 (cached per chunks file) and the reranker load don't depend on
+    # the query embedding: run them on the pool while the dense side goes here
+    def sparse_job() -> Tuple[List[Hit], Dict[Tuple[str, int], dict]]:
+        bm25, chunks = load_bm25_index(Path(chunks_path))
+        return sparse_search(bm25, chunks, query, k_sparse), chunks
+
+    sparse_future = _SEARCH_POOL.submit(sparse_job)
+    reranker_future = _SEARCH_POOL.submit(get_reranker, rerank_model)
+
+    # int8 FAISS copy of the Chroma collection (the collection itself until it's built)
+    store = get_dense_store(str(persist_path), collection_name)
+
+    # Dense search (reuse a precomputed embedding when the caller has one)
+    if query_embedding is not None:
+        q_vec = query_embedding
+    else:
+        q_vec = get_embedder(dense_model).embed_query(query)
+    dense_hits = dense_search(store, q_vec, k_dense)
+
+    sparse_hits, chunk_map = sparse_future.result()
+
+    # RRF fusion
+    fused = rrf_fuse(dense_hits, sparse_hits, top_n=top_fuse)
+
+    # Rerank
+    reranker = reranker_future.result()
+    reranked = rerank_bge(reranker, query, fused, top_n=top_rerank * 2)
+    reranked = dedup_results(reranked)[:top_rerank]
+
+    # Collect context with neighbors
+    collected = collect_with_neighbors(
+        reranked,
+        chunk_map,
+        radius=neighbor_radius,
+        max_tokens=max_context_tokens,
+        encoder_name=encoding,
+    )
+    # Fallback: if no context collected, use reranked docs directly (trimmed)
+    if not collected:
+        enc = get_encoder(encoding)
+        total = 0
+        for hit in reranked:
+            meta, doc = hit.meta, hit.doc
+            if total >= max_context_tokens:
+                break
+            tokens = enc.encode(doc)
+            take = min(len(tokens), max_context_tokens - total)
+            # Only a truncated doc needs decoding; a whole one is used as-is
+            part = doc if take == len(tokens) else enc.decode(tokens[:take])
+            cid = meta.get("chunk_id", f"{meta.get('source','')}:{meta.get('block_idx',-1)}")
+            collected.append((cid, part))
+            total += take
+
+    result = {
+        "query": query,
+        "dense_hits": dense_hits,
+        "sparse_hits": sparse_hits,
+        "fused": fused,
+        "reranked": reranked,
+        "context": collected,
+        "answer_raw": None,
+        "judge_raw": None,
+        "final": None,
+    }
+    if no_llm:
+        return result
+
+    chunk_ids = [cid for cid, _ in collected]
+    context_chunks = [txt for _, txt in collected]
+
+    # First-pass answer
+    top1 = reranked[0].score if reranked else 0.0
+    avg_top5 = sum(r.score for r in reranked[:5]) / max(1, min(5, len(reranked)))
+    low_retrieval_conf = (top1 < 0.35) or (avg_top5 < 0.30)
+    messages = build_messages_answer(
+        query, context_chunks, chunk_ids, low_retrieval_conf=low_retrieval_conf, language="English"
+    )
+    # Stream the answer (forwarding only the decoded "answer" field to ``on_token``)
+    # and stop reading once it is a complete JSON object, so the judge call can
+    # start without waiting for whatever the model emits after the closing brace
+    streamer = JSONFieldStreamer("answer") if on_token is not None else None
+    pieces = []
+    for piece in stream_answer(messages):
+        pieces.append(piece)
+        if streamer is not None:
+            delta = streamer.feed(piece)
+            if delta:
+                on_token(delta)
+        if "}" in piece and _is_complete_json("".join(pieces)):
+            break
+    answer_text = "".join(pieces)
+
+    # Judge pass
+    judge_messages = build_messages_judge(
+        query, context_chunks, chunk_ids, answer_text, language="English"
+    )
+    judge_resp = generate_answer(judge_messages)
+
+    # Parse LLM answer and Judge, then output final JSON
+    try:
+        # Try to parse LLM answer as JSON
+        answer_json = json_loads_llm(answer_text)
+        can_answer = answer_json.get("can_answer", True)
+        confidence = answer_json.get("confidence", 0.5)
+        answer = answer_json.get("answer", answer_text)
+        reason = answer_json.get("reason", "")
+        sources = answer_json.get("sources", chunk_ids)
+    except json.JSONDecodeError:
+        # Fallback: treat as plain text answer
+        can_answer = True
+        confidence = 0.7
+        answer = answer_text
+        reason = "Plain text answer"
+        sources = chunk_ids
+
+    # Try to parse Judge
+    try:
+        judge_json = json_loads_llm(judge_resp.content)
+        is_supported = judge_json.get("is_supported", True)
+        hallucination_level = judge_json.get("hallucination_level", 0)
+        judge_confidence = judge_json.get("overall_confidence", confidence)
+
+        # If Judge says not supported or high hallucination, override
+        if not is_supported or hallucination_level >= 1:
+            can_answer = False
+            confidence = min(confidence, judge_confidence)
+            reason = judge_json.get("comment", "Judge detected issues")
+    except json.JSONDecodeError:
+        pass  # Keep original answer
+
+    result["answer_raw"] = answer_text
+    result["judge_raw"] = judge_resp.content
+    result["final"] = {
+        "can_answer": can_answer,
+        "confidence": confidence,
+        "answer": answer,
+        "reason": reason,
+        "sources": sources,
+        "retrieval_scores": {
+            "top1": top1,
+            "avg_top5": avg_top5,
+            "hits": len(reranked)
+        }
+    }
+    return result
+
+
+async def arun(query: str, **kwargs) -> dict:
+    """Async wrapper around :func:`run`; the blocking pipeline runs in a worker thread."""
+    return await asyncio.to_thread(run, query, **kwargs)
+
+
+def safe_print(text: str):
+    """Print text safely, replacing chars that console encoding cannot handle."""
+    try:
+        print(text)
+    except UnicodeEncodeError:
+        # Get console encoding (e.g., 'gbk' on Windows, 'utf-8' on Linux)
+        console_encoding = sys.stdout.encoding or "utf-8"
+        # Encode to console encoding, replacing problematic chars with '?'
+        safe_bytes = text.encode(console_encoding, errors="replace")
+        safe_text = safe_bytes.decode(console_encoding)
+        print(safe_text)
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="Hybrid dense+sparse retrieval with BGE rerank")
     parser.add_argument("--query", required=True, help="user query text")
     parser.add_argument(
         "--chunks-path",
         type=Path,
-        default=Path("data/markdown/chunked/chunks.jsonl"),
+        default=DEFAULT_CHUNKS_PATH,
         help="path to chunked JSONL for BM25",
     )
     parser.add_argument(
@@ -236,159 +591,52 @@ def main() -> None:
     )
     args = parser.parse_args()
 
-    load_dotenv()
-    if not os.getenv("OPENAI_API_KEY"):
-        raise RuntimeError("Missing OPENAI_API_KEY")
-
-    # Dense embedder
-    embedder = OpenAIEmbeddings(model=args.dense_model)
-
-    # Chroma client
-    client = chromadb.PersistentClient(path=str(args.persist_path))
-    collection = client.get_collection(args.collection)
-
-    # Sparse BM25
-    chunks = load_chunks(args.chunks_path)
-    bm25 = build_bm25(chunks)
-    chunk_map = load_chunk_map(chunks)
-
-    # Dense search
-    q_vec = embedder.embed_query(args.query)
-    dense_hits = dense_search(collection, q_vec, args.k_dense)
-
-    # Sparse search
-    sparse_hits = sparse_search(bm25, args.query, args.k_sparse)
-
-    # RRF fusion
-    fused = rrf_fuse(dense_hits, sparse_hits, top_n=args.top_fuse)
-
-    # Rerank
-    reranker = FlagReranker(args.rerank_model, use_fp16=True)
-    reranked = rerank_bge(reranker, args.query, fused, top_n=args.top_rerank * 2)
-    reranked = dedup_results(reranked)[: args.top_rerank]
-
-    # Collect context with neighbors
-    collected = collect_with_neighbors(
-        reranked,
-        chunk_map,
-        radius=args.neighbor_radius,
-        max_tokens=args.max_context_tokens,
-        encoder_name=args.encoding,
+    result = run(
+        args.query,
+        chunks_path=args.chunks_path,
+        persist_path=args.persist_path,
+        collection_name=args.collection,
+        k_dense=args.k_dense,
+        k_sparse=args.k_sparse,
+        top_fuse=args.top_fuse,
+        top_rerank=args.top_rerank,
+        neighbor_radius=args.neighbor_radius,
+        max_context_tokens=args.max_context_tokens,
+        encoding=args.encoding,
+        dense_model=args.dense_model,
+        rerank_model=args.rerank_model,
+        chat_model=args.chat_model,
+        no_llm=args.no_llm,
     )
-    # Fallback: if no context collected, use reranked docs directly (trimmed)
-    if not collected:
-        enc = get_encoding(args.encoding)
-        total = 0
-        for _id, _sc, meta, doc in reranked:
-            tokens = enc.encode(doc)
-            if total >= args.max_context_tokens:
-                break
-            remain = args.max_context_tokens - total
-            part = enc.decode(tokens[:remain])
-            cid = meta.get("chunk_id", f"{meta.get('source','')}:{meta.get('block_idx',-1)}")
-            collected.append((cid, part))
-            total += len(tokens[:remain])
-
-    chunk_ids = [cid for cid, _ in collected]
-    context_chunks = [txt for _, txt in collected]
-
-    def safe_print(text: str):
-        """Print text safely, replacing chars that console encoding cannot handle."""
-        import sys
-        try:
-            print(text)
-        except UnicodeEncodeError:
-            # Get console encoding (e.g., 'gbk' on Windows, 'utf-8' on Linux)
-            console_encoding = sys.stdout.encoding or "utf-8"
-            # Encode to console encoding, replacing problematic chars with '?'
-            safe_bytes = text.encode(console_encoding, errors="replace")
-            safe_text = safe_bytes.decode(console_encoding)
-            print(safe_text)
+    reranked = result["reranked"]
 
     safe_print(f"\nQuery: {args.query}")
-    safe_print(f"Dense hits: {len(dense_hits)}, Sparse hits: {len(sparse_hits)}, Fused: {len(fused)}, Reranked: {len(reranked)}")
-    for i, (_id, sc, meta, doc) in enumerate(reranked, start=1):
-        src = meta.get("source", "")
-        sec = meta.get("section_path", "")
-        safe_print(f"\n#{i} score={sc:.4f} source={src} section={sec}")
-        safe_print(doc[:400].replace("\n", " "))
+    safe_print(
+        f"Dense hits: {len(result['dense_hits'])}, Sparse hits: {len(result['sparse_hits'])}, "
+        f"Fused: {len(result['fused'])}, Reranked: {len(reranked)}"
+    )
+    for i, hit in enumerate(reranked, start=1):
+        src = hit.meta.get("source", "")
+        sec = hit.meta.get("section_path", "")
+        safe_print(f"\n#{i} score={hit.score:.4f} source={src} section={sec}")
+        safe_print(hit.doc[:400].replace("\n", " "))
 
     safe_print("\nContext for LLM (neighbor-augmented, token-limited):")
-    for i, (cid, chunk) in enumerate(zip(chunk_ids, context_chunks), start=1):
+    for i, (cid, chunk) in enumerate(result["context"], start=1):
         safe_print(f"\n[CTX {i}] chunk_id={cid} {chunk[:400].replace(chr(10), ' ')}")
 
-    if not args.no_llm:
-        # First-pass answer
-        top1 = reranked[0][1] if reranked else 0.0
-        avg_top5 = sum(r[1] for r in reranked[:5]) / max(1, min(5, len(reranked)))
-        low_retrieval_conf = (top1 < 0.35) or (avg_top5 < 0.30)
-        messages = build_messages_answer(
-            args.query, context_chunks, chunk_ids, low_retrieval_conf=low_retrieval_conf, language="English"
-        )
-        resp = generate_answer(messages)
-        answer_text = resp.content
+    if result["final"] is not None:
         safe_print("\nLLM Answer (raw):\n")
-        safe_print(answer_text)
-
-        # Judge pass
-        judge_messages = build_messages_judge(
-            args.query, context_chunks, chunk_ids, answer_text, language="English"
-        )
-        judge_resp = generate_answer(judge_messages)
+        safe_print(result["answer_raw"])
         safe_print("\nJudge:\n")
-        safe_print(judge_resp.content)
-        
-        # Parse LLM answer and Judge, then output final JSON
-        try:
-            # Try to parse LLM answer as JSON
-            answer_json = json.loads(answer_text)
-            can_answer = answer_json.get("can_answer", True)
-            confidence = answer_json.get("confidence", 0.5)
-            answer = answer_json.get("answer", answer_text)
-            reason = answer_json.get("reason", "")
-            sources = answer_json.get("sources", chunk_ids)
-        except json.JSONDecodeError:
-            # Fallback: treat as plain text answer
-            can_answer = True
-            confidence = 0.7
-            answer = answer_text
-            reason = "Plain text answer"
-            sources = chunk_ids
-        
-        # Try to parse Judge
-        try:
-            judge_json = json.loads(judge_resp.content)
-            is_supported = judge_json.get("is_supported", True)
-            hallucination_level = judge_json.get("hallucination_level", 0)
-            judge_confidence = judge_json.get("overall_confidence", confidence)
-            
-            # If Judge says not supported or high hallucination, override
-            if not is_supported or hallucination_level >= 1:
-                can_answer = False
-                confidence = min(confidence, judge_confidence)
-                reason = judge_json.get("comment", "Judge detected issues")
-        except json.JSONDecodeError:
-            pass  # Keep original answer
-        
+        safe_print(result["judge_raw"])
+
         # Output final JSON result for rag_tool to parse
-        final_result = {
-            "can_answer": can_answer,
-            "confidence": confidence,
-            "answer": answer,
-            "reason": reason,
-            "sources": sources,
-            "retrieval_scores": {
-                "top1": top1,
-                "avg_top5": avg_top5,
-                "hits": len(reranked)
-            }
-        }
         safe_print("\n" + "="*80)
         safe_print("FINAL_JSON_RESULT:")
-        safe_print(json.dumps(final_result, ensure_ascii=False))
+        safe_print(json_dumps(result["final"]))
         safe_print("="*80)
 
 
 if __name__ == "__main__":
     main()
-
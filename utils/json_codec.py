@@ -0,0 +1,37 @@
+"""Fast JSON helpers backed by orjson."""
+from __future__ import annotations
+
+import re
+from typing import Any, Union
+
+import orjson
+
+_DUMPS_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+_OBJECT_START = re.compile(r"\s*\{")
+_CODE_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+
+
+def json_loads(data: Union[str, bytes]) -> Any:
+    """Parse JSON; raises ``json.JSONDecodeError`` (via orjson's subclass) on bad input."""
+    return orjson.loads(data)
+
+
+def json_loads_llm(text: str) -> Any:
+    """Parse model output, tolerating a surrounding ```json ... ``` fence."""
+    return orjson.loads(_CODE_FENCE.sub("", text.strip()))
+
+
+def json_dumps(obj: Any, indent: bool = False) -> str:
+    """Serialize to a str, keeping non-ASCII as-is (like ``ensure_ascii=False``)."""
+    option = _DUMPS_OPTIONS | orjson.OPT_INDENT_2 if indent else _DUMPS_OPTIONS
+    return orjson.dumps(obj, option=option).decode("utf-8")
+
+
+def json_line(obj: Any) -> bytes:
+    """Serialize one JSONL record (UTF-8 bytes, trailing newline included)."""
+    return orjson.dumps(obj, option=_DUMPS_OPTIONS | orjson.OPT_APPEND_NEWLINE)
+
+
+def looks_like_json_object(text: str) -> bool:
+    """Same as ``text.strip().startswith("{")`` without copying the string."""
+    return _OBJECT_START.match(text) is not None
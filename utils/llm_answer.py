@@ -1,16 +1,38 @@
 from __future__ import annotations
 
-from typing import List
+from functools import lru_cache
+from typing import Iterator, List, Optional
 
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import BaseMessage
 
 
+@lru_cache(maxsize=8)
+def get_chat_llm(
+    model_name: str, temperature: float, timeout: Optional[float] = None
+) -> ChatOpenAI:
+    """One client per (model, temperature, timeout) per process.
+
+    Reusing it keeps the underlying HTTP connection pool (and its TLS
+    sessions) warm across calls.
+    """
+    return ChatOpenAI(model=model_name, temperature=temperature, timeout=timeout)
+
+
 def generate_answer(
     messages: List[BaseMessage],
     model_name: str = "gpt-5",
     temperature: float = 1,
 ):
-    llm = ChatOpenAI(model=model_name, temperature=temperature)
-    return llm.invoke(messages)
+    return get_chat_llm(model_name, temperature).invoke(messages)
+
 
+def stream_answer(
+    messages: List[BaseMessage],
+    model_name: str = "gpt-5",
+    temperature: float = 1,
+) -> Iterator[str]:
+    """Yield the response content piece by piece as the model generates it."""
+    for chunk in get_chat_llm(model_name, temperature).stream(messages):
+        if chunk.content:
+            yield chunk.content
@@ -1,12 +1,29 @@
 """Memory Manager: Manages conversation history using LangChain."""
 from __future__ import annotations
 
+import time
+from array import array
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 from collections import deque
 
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 
+# Role codes for the columnar history
+_USER, _ASSISTANT = 0, 1
+_ROLE_NAMES = ("user", "assistant")
+_ROLE_LABELS = ("👤 User", "🤖 Assistant")
+
+# get_summary shows the last 3 turns, each message cut to 100 chars
+SUMMARY_PREVIEW_MESSAGES = 6
+SUMMARY_PREVIEW_LEN = 100
+
+
+def _preview_line(role: int, message: str) -> str:
+    if len(message) > SUMMARY_PREVIEW_LEN:
+        message = message[:SUMMARY_PREVIEW_LEN] + "..."
+    return f"{_ROLE_LABELS[role]}: {message}\n"
+
 
 class MemoryManager:
     """Manages conversation memory for the AI agent.
@@ -27,38 +44,80 @@ class MemoryManager:
         self.window_size = k
         # Use deque for efficient windowed storage (stores LangChain Message objects)
         self.windowed_messages: deque = deque(maxlen=k * 2)  # k turns = k*2 messages
-        # Full history with metadata
-        self.full_history: List[Dict[str, Any]] = []
+        # Full history, stored column-wise: one entry per message in each column;
+        # metadata is kept only for messages that have any
+        self._roles = array("B")
+        self._contents: List[str] = []
+        self._ts = array("q")  # time.time_ns() at insertion
+        self._metadata: Dict[int, Dict] = {}
+        # Ready-made get_summary lines for the most recent messages
+        self._preview: deque = deque(maxlen=SUMMARY_PREVIEW_MESSAGES)
+
+    def _append(
+        self, role: int, message: str, metadata: Optional[Dict], ts_ns: Optional[int] = None
+    ) -> None:
+        if metadata:
+            self._metadata[len(self._contents)] = metadata
+        self._roles.append(role)
+        self._contents.append(message)
+        self._ts.append(time.time_ns() if ts_ns is None else ts_ns)
+        self._preview.append(_preview_line(role, message))
+
+    def _record(self, i: int) -> Dict[str, Any]:
+        return {
+            "role": _ROLE_NAMES[self._roles[i]],
+            "content": self._contents[i],
+            "metadata": self._metadata.get(i, {}),
+            "ts_ns": self._ts[i],
+            "timestamp": datetime.fromtimestamp(self._ts[i] / 1e9).isoformat(),
+        }
+
+    @property
+    def full_history(self) -> List[Dict[str, Any]]:
+        """Full history as message dicts (role, content, metadata, ts_ns, timestamp).
+
+        ``timestamp`` is the ISO string of ``ts_ns``, formatted only here. The
+        list is built on each access, so appending to it does not add a
+        message; use ``add_user_message``/``add_ai_message``, or assign a whole
+        list of message dicts to replace the history.
+        """
+        return [self._record(i) for i in range(len(self._contents))]
+
+    @full_history.setter
+    def full_history(self, history: List[Dict[str, Any]]) -> None:
+        self._roles = array("B")
+        self._contents = []
+        self._ts = array("q")
+        self._metadata = {}
+        self._preview.clear()
+        for msg in history:
+            if msg["role"] == "user":
+                role = _USER
+            elif msg["role"] == "assistant":
+                role = _ASSISTANT
+            else:
+                continue
+            ts_ns = msg.get("ts_ns")
+            if ts_ns is None and msg.get("timestamp"):
+                ts_ns = int(datetime.fromisoformat(msg["timestamp"]).timestamp() * 1e9)
+            self._append(role, msg["content"], msg.get("metadata"), ts_ns)
     
     def add_user_message(self, message: str, metadata: Optional[Dict] = None) -> None:
         """Add a user message to memory."""
         user_msg = HumanMessage(content=message)
         self.windowed_messages.append(user_msg)
-        
-        # Store in full history with metadata
-        self.full_history.append({
-            "role": "user",
-            "content": message,
-            "metadata": metadata or {},
-            "timestamp": datetime.now().isoformat()
-        })
+        self._append(_USER, message, metadata)
     
     def add_ai_message(self, message: str, metadata: Optional[Dict] = None) -> None:
         """Add an AI message to memory."""
         ai_msg = AIMessage(content=message)
         self.windowed_messages.append(ai_msg)
-        
-        # Store in full history with metadata
-        self.full_history.append({
-            "role": "assistant",
-            "content": message,
-            "metadata": metadata or {},
-            "timestamp": datetime.now().isoformat()
-        })
+        self._append(_ASSISTANT, message, metadata)
     
     def get_recent_history(self, n: int = 5) -> List[Dict[str, Any]]:
         """Get recent N conversation turns."""
-        return self.full_history[-n*2:] if self.full_history else []
+        total = len(self._contents)
+        return [self._record(i) for i in range(max(0, total - n * 2), total)]
     
     def get_context_string(self, include_system: bool = True) -> str:
         """Get conversation history as a formatted string.
@@ -108,24 +167,22 @@ class MemoryManager:
     def clear(self) -> None:
         """Clear all conversation history."""
         self.windowed_messages.clear()
-        self.full_history = []
+        self._roles = array("B")
+        self._contents = []
+        self._ts = array("q")
+        self._metadata = {}
+        self._preview.clear()
     
     def get_summary(self) -> str:
         """Get a summary of the conversation."""
-        if not self.full_history:
+        if not self._contents:
             return "No conversation history."
         
-        total_turns = len(self.full_history) // 2
-        recent = self.get_recent_history(3)
-        
-        summary = f"Total conversation turns: {total_turns}\n\n"
-        summary += "Recent exchanges:\n"
-        for msg in recent[-6:]:  # Last 3 turns (6 messages)
-            role = "👤 User" if msg["role"] == "user" else "🤖 Assistant"
-            content = msg["content"][:100] + "..." if len(msg["content"]) > 100 else msg["content"]
-            summary += f"{role}: {content}\n"
-        
-        return summary
+        total_turns = len(self._contents) // 2
+        return (
+            f"Total conversation turns: {total_turns}\n\n"
+            "Recent exchanges:\n" + "".join(self._preview)
+        )
     
     def to_dict(self) -> Dict[str, Any]:
         """Serialize memory to dictionary for persistence."""
@@ -151,12 +208,12 @@ class MemoryManager:
         
         # Restore windowed messages from full history
         # Only restore the last k*2 messages to maintain window
-        recent_history = manager.full_history[-(window_size * 2):]
-        for msg in recent_history:
-            if msg["role"] == "user":
-                manager.windowed_messages.append(HumanMessage(content=msg["content"]))
-            elif msg["role"] == "assistant":
-                manager.windowed_messages.append(AIMessage(content=msg["content"]))
+        total = len(manager._contents)
+        for i in range(max(0, total - window_size * 2), total):
+            if manager._roles[i] == _USER:
+                manager.windowed_messages.append(HumanMessage(content=manager._contents[i]))
+            else:
+                manager.windowed_messages.append(AIMessage(content=manager._contents[i]))
         
         return manager
 
@@ -4,6 +4,89 @@ from typing import List, Sequence
 
 from langchain_core.messages import HumanMessage, SystemMessage, BaseMessage
 
+from utils.json_codec import json_dumps
+
+
+def format_context(chunk_ids: Sequence[str], context_chunks: Sequence[str]) -> str:
+    """Number the context chunks as ``[CTX i] chunk_id=...`` blocks."""
+    return "\n\n".join(
+        [
+            f"[CTX {i}] chunk_id={cid}\n{c}"
+            for i, (cid, c) in enumerate(zip(chunk_ids, context_chunks), start=1)
+        ]
+    )
+
+
+SYSTEM_TEXT_ANSWER = (
+    "You are a manual assistant with strong experience in coffee machine maintenance and troubleshooting. "
+    "Only use the provided context; do not fabricate. "
+    "If context is insufficient, say you cannot find reliable info and tell customers to contact support. "
+    "Always cite chunk_id and section/source. Provide a confidence score (0.0-1.0) reflecting how well the context supports the answer. "
+    "If confidence < 0.6 OR low_retrieval_conf=true, set can_answer=false and suggest contacting support."
+)
+
+SYSTEM_TEXT_JUDGE = (
+    "You are a strict judge. Evaluate if the assistant answer is supported by context. "
+    "Only judge support; do not invent new info."
+)
+
+SYSTEM_TEXT_UNIFIED = (
+    "You are a routing assistant for a coffee machine support system. "
+    "Decide the best action for the user query, using the provided manual excerpts to judge whether "
+    "the manuals can answer it.\n"
+    "Possible actions: rag, escalate, db, api.\n"
+    "- api: live data such as order, status, tracking, inventory, stock, price, shipping, delivery, payment.\n"
+    "- rag: static manual knowledge such as how to, troubleshoot, fix, instructions, features, specifications.\n"
+    "- escalate: needs a human, such as complaint, refund, warranty claim, legal, safety concern, speak to someone.\n"
+    "- db: structured data lookups such as customer records or purchase history.\n"
+    "Queries about orders, inventory, prices, or service status should ALWAYS use api, even if retrieval scores are low.\n"
+    "Choose rag only if the context looks relevant to the question; do not answer the question yourself."
+)
+
+# User-message templates, filled with str.format_map; literal braces of the
+# JSON schemas are doubled
+_USER_TEMPLATE_ANSWER = (
+    "low_retrieval_conf: {low_retrieval_conf}\n"
+    "Question: {query}\n"
+    "Context:\n{ctx}\n"
+    "Respond ONLY in JSON, no extra text:\n"
+    "{{\n"
+    '  "can_answer": true/false,\n'
+    '  "confidence": number 0.0-1.0,\n'
+    '  "answer": "text answer in {language}",\n'
+    '  "reason": "brief reason",\n'
+    '  "sources": ["chunk_id1", "chunk_id2"]\n'
+    "}}\n"
+    "Rules: If can_answer=false OR confidence<0.5 OR low_retrieval_conf=true, set can_answer=false, confidence=0.0, answer='No reliable information found, please contact support', reason explain insufficiency, sources=[]"
+)
+
+_USER_TEMPLATE_JUDGE = (
+    "Question: {query}\n"
+    "Context:\n{ctx}\n"
+    "Assistant answer:\n{answer_text}\n"
+    "Respond ONLY in JSON:\n"
+    "{{\n"
+    '  "is_supported": true/false,\n'
+    '  "hallucination_level": 0/1/2,\n'
+    '  "missing_info": true/false,\n'
+    '  "overall_confidence": 0.0-1.0,\n'
+    '  "comment": "brief reason"\n'
+    "}}\n"
+    "If not supported OR hallucination_level>=1, set overall_confidence<=0.5."
+)
+
+_USER_TEMPLATE_UNIFIED = (
+    "retrieval_signals: {signals}\n"
+    "Question: {query}\n"
+    "Context:\n{ctx}\n"
+    "Respond ONLY in JSON, no extra text:\n"
+    "{{\n"
+    '  "action": "rag|escalate|db|api",\n'
+    '  "confidence": number 0.0-1.0,\n'
+    '  "reason": "brief reason (used as the support ticket reason when escalating)"\n'
+    "}}"
+)
+
 
 def build_messages_answer(
     query: str,
@@ -12,32 +95,15 @@ def build_messages_answer(
     low_retrieval_conf: bool,
     language: str = "Chinese",
 ) -> List[BaseMessage]:
-    system_text = (
-        "You are a manual assistant with strong experience in coffee machine maintenance and troubleshooting. "
-        "Only use the provided context; do not fabricate. "
-        "If context is insufficient, say you cannot find reliable info and tell customers to contact support. "
-        "Always cite chunk_id and section/source. Provide a confidence score (0.0-1.0) reflecting how well the context supports the answer. "
-        "If confidence < 0.6 OR low_retrieval_conf=true, set can_answer=false and suggest contacting support."
-    )
-    ctx_lines = []
-    for i, (cid, c) in enumerate(zip(chunk_ids, context_chunks), start=1):
-        ctx_lines.append(f"[CTX {i}] chunk_id={cid}\n{c}")
-    ctx = "\n\n".join(ctx_lines)
-    user_text = (
-        f"low_retrieval_conf: {str(low_retrieval_conf).lower()}\n"
-        f"Question: {query}\n"
-        f"Context:\n{ctx}\n"
-        f"Respond ONLY in JSON, no extra text:\n"
-        "{\n"
-        '  "can_answer": true/false,\n'
-        '  "confidence": number 0.0-1.0,\n'
-        '  "answer": "text answer in ' + language + '",\n'
-        '  "reason": "brief reason",\n'
-        '  "sources": ["chunk_id1", "chunk_id2"]\n'
-        "}\n"
-        "Rules: If can_answer=false OR confidence<0.5 OR low_retrieval_conf=true, set can_answer=false, confidence=0.0, answer='No reliable information found, please contact support', reason explain insufficiency, sources=[]"
+    user_text = _USER_TEMPLATE_ANSWER.format_map(
+        {
+            "low_retrieval_conf": str(low_retrieval_conf).lower(),
+            "query": query,
+            "ctx": format_context(chunk_ids, context_chunks),
+            "language": language,
+        }
     )
-    return [SystemMessage(content=system_text), HumanMessage(content=user_text)]
+    return [SystemMessage(content=SYSTEM_TEXT_ANSWER), HumanMessage(content=user_text)]
 
 
 def build_messages_judge(
@@ -47,27 +113,28 @@ def build_messages_judge(
     answer_text: str,
     language: str = "Chinese",
 ) -> List[BaseMessage]:
-    system_text = (
-        "You are a strict judge. Evaluate if the assistant answer is supported by context. "
-        "Only judge support; do not invent new info."
-    )
-    ctx_lines = []
-    for i, (cid, c) in enumerate(zip(chunk_ids, context_chunks), start=1):
-        ctx_lines.append(f"[CTX {i}] chunk_id={cid}\n{c}")
-    ctx = "\n\n".join(ctx_lines)
-    user_text = (
-        f"Question: {query}\n"
-        f"Context:\n{ctx}\n"
-        f"Assistant answer:\n{answer_text}\n"
-        "Respond ONLY in JSON:\n"
-        "{\n"
-        '  "is_supported": true/false,\n'
-        '  "hallucination_level": 0/1/2,\n'
-        '  "missing_info": true/false,\n'
-        '  "overall_confidence": 0.0-1.0,\n'
-        '  "comment": "brief reason"\n'
-        "}\n"
-        "If not supported OR hallucination_level>=1, set overall_confidence<=0.5."
+    user_text = _USER_TEMPLATE_JUDGE.format_map(
+        {
+            "query": query,
+            "ctx": format_context(chunk_ids, context_chunks),
+            "answer_text": answer_text,
+        }
     )
-    return [SystemMessage(content=system_text), HumanMessage(content=user_text)]
+    return [SystemMessage(content=SYSTEM_TEXT_JUDGE), HumanMessage(content=user_text)]
 
+
+def build_messages_unified(
+    query: str,
+    context_chunks: Sequence[str],
+    chunk_ids: Sequence[str],
+    retrieval_signals: dict,
+) -> List[BaseMessage]:
+    """Route a query the hard rules can't decide, with its top retrieved chunks as evidence."""
+    user_text = _USER_TEMPLATE_UNIFIED.format_map(
+        {
+            "signals": json_dumps(retrieval_signals),
+            "query": query,
+            "ctx": format_context(chunk_ids, context_chunks),
+        }
+    )
+    return [SystemMessage(content=SYSTEM_TEXT_UNIFIED), HumanMessage(content=user_text)]
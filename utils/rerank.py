@@ -0,0 +1,83 @@
+"""Rerank: BGE cross-encoder reranking with a process-wide, pre-warmed model."""
+from __future__ import annotations
+
+from dataclasses import replace
+from functools import lru_cache
+from typing import TYPE_CHECKING, List
+
+import numpy as np
+import torch
+from FlagEmbedding import FlagReranker
+
+if TYPE_CHECKING:
+    from utils.hybrid_retrieve import Hit
+
+RERANK_BATCH_SIZE = 16
+RERANK_MAX_LENGTH = 512
+
+
+@lru_cache(maxsize=2)
+def get_reranker(model: str, use_fp16: bool = True) -> FlagReranker:
+    """Load the BGE reranker once per (checkpoint, precision) per process.
+
+    The model is put in eval mode and run once on a dummy pair, so the first
+    real query doesn't pay for CUDA context setup and kernel selection.
+    FP16 is only used on CUDA.
+    """
+    use_cuda = torch.cuda.is_available()
+    reranker = FlagReranker(model, use_fp16=use_fp16 and use_cuda)
+    # FlagEmbedding >= 1.3 only moves the model to the GPU (and to fp16) inside
+    # compute_score, which score_pairs bypasses, so place it here
+    if use_cuda:
+        reranker.model.to("cuda")
+        if use_fp16:
+            reranker.model.half()
+    reranker.model.eval()
+    score_pairs(reranker, "warmup", ["warmup"])
+    return reranker
+
+
+def score_pairs(reranker: FlagReranker, query: str, docs: List[str]) -> np.ndarray:
+    """Sigmoid relevance of each doc to ``query`` (same as ``compute_score(normalize=True)``).
+
+    Runs the cross-encoder directly on length-sorted mini-batches, so each batch
+    pads only to its own longest doc and no per-call Python wrapping is involved.
+    """
+    model = reranker.model
+    device = next(model.parameters()).device
+    order = np.argsort([len(doc) for doc in docs], kind="stable")
+    scores = np.empty(len(docs), dtype=np.float32)
+    with torch.inference_mode():
+        for start in range(0, len(order), RERANK_BATCH_SIZE):
+            idx = order[start : start + RERANK_BATCH_SIZE]
+            inputs = reranker.tokenizer(
+                [query] * len(idx),
+                [docs[i] for i in idx],
+                padding=True,
+                truncation=True,
+                max_length=RERANK_MAX_LENGTH,
+                return_tensors="pt",
+            )
+            if device.type == "cuda":
+                inputs = {k: v.pin_memory().to(device, non_blocking=True) for k, v in inputs.items()}
+            logits = model(**inputs, return_dict=True).logits.view(-1).float()
+            scores[idx] = torch.sigmoid(logits).cpu().numpy()
+    return scores
+
+
+def rerank_bge(
+    reranker: FlagReranker,
+    query: str,
+    candidates: List[Hit],
+    top_n: int = 8,
+) -> List[Hit]:
+    if not candidates:
+        return []
+    scores = score_pairs(reranker, query, [hit.doc for hit in candidates])
+    top_n = min(top_n, len(candidates))
+    if top_n <= 0:
+        return []
+    # Only the kept hits get sorted; O(N) selection for the rest of the pool
+    top = np.argpartition(-scores, top_n - 1)[:top_n]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [replace(candidates[i], score=float(scores[i])) for i in top]
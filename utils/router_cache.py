@@ -0,0 +1,305 @@
+"""Router Cache: Persistent exact + semantic cache of LLM routing decisions, plus an
+opt-in nearest-centroid classifier trained on them."""
+from __future__ import annotations
+
+import atexit
+import os
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from utils.json_codec import json_dumps, json_loads
+
+DEFAULT_CACHE_DIR = Path(
+    os.getenv("RAG_ROUTER_CACHE", str(Path.home() / ".cache" / "rag_router"))
+)
+SIMILARITY_THRESHOLD = 0.92
+MAX_ENTRIES = 1024
+# put() only marks the cache dirty; it is written this many seconds later (and
+# at exit), off the request path
+FLUSH_DELAY_S = 5.0
+# Retrieval signals are bucketed this coarsely into the key: a decision is only
+# reused for queries whose top1 / avg_top5 fall in the same band
+SIGNAL_BAND_WIDTH = 0.1
+
+# Nearest-centroid classifier over the cached (embedding, action) pairs. Off
+# unless RAG_ROUTER_CLASSIFIER=1. An action needs this many examples to get a
+# centroid, and a prediction is only made when the query is close to its
+# centroid and clearly closer than to any other action's
+CLASSIFIER_ENABLED = os.getenv("RAG_ROUTER_CLASSIFIER", "0") == "1"
+CLASSIFY_MIN_EXAMPLES = 8
+CLASSIFY_MIN_SIMILARITY = 0.6
+CLASSIFY_MIN_MARGIN = 0.1
+# Even when enabled, it only bypasses the LLM once its leave-one-out agreement
+# with the cached LLM decisions is at least this, over at least this many
+# held-out predictions
+CLASSIFY_MIN_AGREEMENT = 0.95
+CLASSIFY_MIN_HELDOUT = 20
+
+_PUNCT_RE = re.compile(r"[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def _normalize(query: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace."""
+    return _SPACE_RE.sub(" ", _PUNCT_RE.sub(" ", query.lower())).strip()
+
+
+def signal_band(signals: dict) -> str:
+    """``"<top1 bucket>:<avg_top5 bucket>"`` for the retrieval signals."""
+    return ":".join(
+        str(int(float(signals.get(name) or 0) / SIGNAL_BAND_WIDTH))
+        for name in ("top1", "avg_top5")
+    )
+
+
+def _cache_key(query: str, signals: dict) -> str:
+    return f"{signal_band(signals)}|{_normalize(query)}"
+
+
+def _band_of(key: str) -> str:
+    return key.partition("|")[0]
+
+
+class RouterCache:
+    """LRU map of (signal band, normalized query) -> ``{action, confidence, reason}``.
+
+    Lookups try the exact key first, then (when the caller has the query
+    embedding) the most cosine-similar cached query of the same signal band
+    above ``threshold``. Decisions live in ``<model>.json``, their unit-norm
+    embeddings in ``<model>.npy``; both are replaced atomically by ``flush``,
+    which ``put`` schedules ``FLUSH_DELAY_S`` later and which also runs at exit.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        threshold: float = SIMILARITY_THRESHOLD,
+        max_entries: int = MAX_ENTRIES,
+        classifier: bool = CLASSIFIER_ENABLED,
+    ):
+        self.path = Path(path)
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.classifier = classifier
+        self._lock = threading.Lock()
+        # Serializes flushes, so the slow file writes never hold self._lock
+        self._flush_lock = threading.Lock()
+        self._decisions: "OrderedDict[str, dict]" = OrderedDict()
+        self._vecs: Dict[str, np.ndarray] = {}
+        # Per band, stacked (keys, matrix) of self._vecs; rebuilt lazily after changes
+        self._index: Dict[str, tuple] = {}
+        # (actions, unit centroids, held-out agreement) of the classifier,
+        # rebuilt lazily as well
+        self._centroids: Optional[tuple] = None
+        self._dirty = False
+        self._timer: Optional[threading.Timer] = None
+        self._load()
+        atexit.register(self.flush)
+
+    def _load(self) -> None:
+        """Read the saved cache; a missing, unreadable or corrupt one starts empty."""
+        try:
+            if not self.path.exists():
+                return
+            data = json_loads(self.path.read_bytes())
+            decisions = [(e["key"], dict(e["decision"])) for e in data["entries"]]
+            vec_keys = data.get("vec_keys", [])
+            vec_path = self.path.with_suffix(".npy")
+            matrix = np.load(vec_path) if vec_keys and vec_path.exists() else None
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        self._decisions.update(decisions)
+        if matrix is not None and len(matrix) == len(vec_keys):
+            self._vecs.update((k, v) for k, v in zip(vec_keys, matrix) if k in self._decisions)
+
+    def get(
+        self, query: str, signals: dict, query_embedding: Optional[Sequence[float]] = None
+    ) -> Optional[dict]:
+        key = _cache_key(query, signals)
+        with self._lock:
+            if key in self._decisions:
+                self._decisions.move_to_end(key)
+                return dict(self._decisions[key])
+            if query_embedding is None or not self._vecs:
+                return None
+            band = _band_of(key)
+            if band not in self._index:
+                keys = [k for k in self._vecs if _band_of(k) == band]
+                self._index[band] = (keys, np.stack([self._vecs[k] for k in keys]) if keys else None)
+            keys, matrix = self._index[band]
+            if matrix is None:
+                return None
+            q = _unit(query_embedding)
+            if q.shape[0] != matrix.shape[1]:
+                return None
+            sims = matrix @ q
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                return None
+            self._decisions.move_to_end(keys[best])
+            return dict(self._decisions[keys[best]])
+
+    def classify(self, query_embedding: Sequence[float]) -> Optional[dict]:
+        """Predict the action from the centroids of past LLM decisions' embeddings.
+
+        A cheap local tier between the cache and the LLM, used only when the
+        cache was created with ``classifier=True`` (``RAG_ROUTER_CLASSIFIER=1``) and ``evaluate_classifier``
+        agrees well enough with the LLM on held-out decisions. The returned
+        confidence is that held-out agreement, not the raw cosine.
+        """
+        if not self.classifier:
+            return None
+        with self._lock:
+            if self._centroids is None:
+                actions, vecs, labels = self._training_set()
+                report = _leave_one_out(vecs, labels, len(actions))
+                agreement = report["agreement"] if report["predicted"] >= CLASSIFY_MIN_HELDOUT else 0.0
+                self._centroids = (actions, _centroids(vecs, labels, len(actions)), agreement)
+            actions, centroids, agreement = self._centroids
+        if len(actions) < 2 or agreement < CLASSIFY_MIN_AGREEMENT:
+            return None
+        best = _predict(centroids, _unit(query_embedding))
+        if best is None:
+            return None
+        return {
+            "action": actions[best],
+            "confidence": round(agreement, 2),
+            "reason": "Closest to past routing decisions",
+        }
+
+    def evaluate_classifier(self) -> dict:
+        """Leave-one-out check of the classifier against the cached LLM decisions.
+
+        Each cached decision is predicted from the centroids of all the others.
+        Returns ``{"examples", "predicted", "agreement"}``: how many decisions
+        were held out, how many got a confident prediction, and the share of
+        those that match the LLM's action.
+        """
+        with self._lock:
+            actions, vecs, labels = self._training_set()
+        return _leave_one_out(vecs, labels, len(actions))
+
+    def _training_set(self) -> tuple:
+        """``(actions, unit vectors, action index per vector)`` of the actions with
+        at least ``CLASSIFY_MIN_EXAMPLES`` embedded decisions."""
+        by_action: Dict[str, list] = {}
+        for key, vec in self._vecs.items():
+            by_action.setdefault(self._decisions[key].get("action"), []).append(vec)
+        groups = [(a, vs) for a, vs in by_action.items() if a and len(vs) >= CLASSIFY_MIN_EXAMPLES]
+        actions = [a for a, _ in groups]
+        if not groups:
+            return actions, np.zeros((0, 0), dtype=np.float32), np.zeros(0, dtype=np.int64)
+        vecs = np.stack([v for _, vs in groups for v in vs])
+        labels = np.repeat(np.arange(len(groups)), [len(vs) for _, vs in groups])
+        return actions, vecs, labels
+
+    def put(
+        self,
+        query: str,
+        signals: dict,
+        decision: dict,
+        query_embedding: Optional[Sequence[float]] = None,
+    ) -> None:
+        """Store a decision; it is written to disk by the next (scheduled) flush."""
+        key = _cache_key(query, signals)
+        with self._lock:
+            self._decisions[key] = dict(decision)
+            self._decisions.move_to_end(key)
+            if query_embedding is not None:
+                self._vecs[key] = _unit(query_embedding)
+            while len(self._decisions) > self.max_entries:
+                old, _ = self._decisions.popitem(last=False)
+                self._vecs.pop(old, None)
+            self._index = {}
+            self._centroids = None
+            self._dirty = True
+            if self._timer is None:
+                self._timer = threading.Timer(FLUSH_DELAY_S, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self) -> None:
+        """Write the cache to disk if it changed since the last flush."""
+        with self._flush_lock:
+            # Snapshot under the lock (decision dicts and vectors are never
+            # mutated in place), then stack and write without holding it
+            with self._lock:
+                self._timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                entries = [{"key": k, "decision": d} for k, d in self._decisions.items()]
+                vecs = list(self._vecs.items())
+            try:
+                self._save(entries, vecs)
+            except OSError:
+                with self._lock:
+                    self._dirty = True
+
+    def _save(self, entries: list, vecs: list) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        vec_keys = [k for k, _ in vecs]
+        if vecs:
+            vec_path = self.path.with_suffix(".npy")
+            tmp = vec_path.with_name(vec_path.name + ".tmp")
+            with tmp.open("wb") as f:
+                np.save(f, np.stack([v for _, v in vecs]))
+            os.replace(tmp, vec_path)
+        data = {"entries": entries, "vec_keys": vec_keys}
+        # Written last: vec_keys describes the .npy saved just before
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json_dumps(data), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+def _centroids(vecs: np.ndarray, labels: np.ndarray, n_actions: int) -> Optional[np.ndarray]:
+    if not n_actions:
+        return None
+    return np.stack([_unit(vecs[labels == a].mean(axis=0)) for a in range(n_actions)])
+
+
+def _predict(centroids: Optional[np.ndarray], q: np.ndarray) -> Optional[int]:
+    """Index of the clearly closest centroid, or None."""
+    if centroids is None or len(centroids) < 2 or q.shape[0] != centroids.shape[1]:
+        return None
+    sims = centroids @ q
+    second, best = np.argsort(sims)[-2:]
+    if sims[best] < CLASSIFY_MIN_SIMILARITY or sims[best] - sims[second] < CLASSIFY_MIN_MARGIN:
+        return None
+    return int(best)
+
+
+def _leave_one_out(vecs: np.ndarray, labels: np.ndarray, n_actions: int) -> dict:
+    predicted = agreed = 0
+    if n_actions >= 2:
+        sums = np.stack([vecs[labels == a].sum(axis=0) for a in range(n_actions)])
+        for vec, label in zip(vecs, labels):
+            held_out = sums.copy()
+            held_out[label] -= vec
+            best = _predict(np.stack([_unit(c) for c in held_out]), vec)
+            if best is not None:
+                predicted += 1
+                agreed += int(best == label)
+    return {
+        "examples": len(vecs),
+        "predicted": predicted,
+        "agreement": agreed / predicted if predicted else 0.0,
+    }
+
+
+def _unit(vec: Sequence[float]) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm else v
+
+
+@lru_cache(maxsize=4)
+def get_router_cache(model: str) -> RouterCache:
+    """One cache per routing model per process (decisions differ across models)."""
+    return RouterCache(DEFAULT_CACHE_DIR / f"{model}.json")
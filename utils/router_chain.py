@@ -3,19 +3,150 @@ from __future__ import annotations
 
 import argparse
 import json
+import re
 import sys
+from functools import lru_cache
 from pathlib import Path
-from typing import List
+from typing import TYPE_CHECKING, Iterator, List, Optional, Sequence, Tuple
 
-from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_openai import ChatOpenAI
-from dotenv import load_dotenv
+# langchain_openai, langchain_core and dotenv are imported where they are first
+# needed: rule- and keyword-routed queries never load the LLM stack
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
 
 # Ensure project root import
 ROOT = Path(__file__).resolve().parent.parent
 if str(ROOT) not in sys.path:
     sys.path.append(str(ROOT))
 
+from utils.json_codec import json_dumps, json_line, json_loads, json_loads_llm
+from utils.router_cache import get_router_cache
+
+# The router only emits a small {"action", "confidence", "reason"} object
+# (~40 tokens with a 15-word reason); the cap bounds verbose completions
+ROUTER_MAX_TOKENS = 80
+
+# Hard-rule thresholds on (top1, avg_top5, hits), shared by apply_hard_rules and
+# the router prompt: all at or above RAG_THRESHOLDS -> rag; any below
+# ESCALATE_THRESHOLDS -> escalate; anything else is the gray zone
+RAG_THRESHOLDS = (0.5, 0.35, 3)
+ESCALATE_THRESHOLDS = (0.15, 0.10, 2)
+
+# Every router request starts with the same system prompt: OpenAI models get a
+# fixed prompt_cache_key so those requests land on the same prefix cache.
+# Bump the version whenever ROUTER_SYSTEM_TEXT changes.
+ROUTER_PROMPT_CACHE_KEY = "coffee-router-v3"
+_OPENAI_MODEL_PREFIXES = ("gpt-", "o1", "o3", "o4")
+
+# Structured output: models that support json_schema can only emit these three
+# fields, in this order (action and confidence first, so streaming can stop early)
+ROUTER_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "route",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "action": {"type": "string", "enum": ["rag", "escalate", "db", "api"]},
+                "confidence": {"type": "number"},
+                "reason": {"type": "string", "description": "Brief reason, at most 15 words"},
+            },
+            "required": ["action", "confidence", "reason"],
+            "additionalProperties": False,
+        },
+    },
+}
+_SCHEMA_MODEL_PREFIXES = ("gpt-4o", "gpt-4.1", "gpt-5", "o1", "o3", "o4")
+
+# Unambiguous trigger phrases, scanned in one pass of a single alternation; the
+# named group of each match tells its action. Generic single words from the
+# prompt's trigger lists ("status", "order", "issue", "fix", ...) are left to the
+# LLM: they show up in every kind of query ("an issue with my order", "in order to")
+_KEYWORD_PHRASES = {
+    "api": (
+        "order status",
+        "track(?:ing)? my (?:order|package|parcel|shipment|delivery)",
+        "tracking number",
+        "where is my (?:order|package|parcel|shipment|delivery)",
+        "(?:shipping|delivery|payment|service) status",
+        "in stock",
+        "out of stock",
+        "check (?:the )?inventory",
+    ),
+    "escalate": (
+        "refunds?",
+        "warranty claim",
+        "human agent",
+        "(?:speak|talk) to (?:someone|a human|a person|a manager)",
+        "(?:file|make) a complaint",
+        "safety concern",
+    ),
+    "rag": (
+        "how do i",
+        "how to",
+        "troubleshoot\\w*",
+        "user manual",
+    ),
+}
+_KEYWORD_RE = re.compile(
+    r"\b(?:"
+    + "|".join(
+        f"(?P<{intent}>" + "|".join(p.replace(" ", r"\s+") for p in phrases) + ")"
+        for intent, phrases in _KEYWORD_PHRASES.items()
+    )
+    + r")\b",
+    re.IGNORECASE,
+)
+_API, _ESCALATE, _RAG = 1, 2, 4
+_KEYWORD_BITS = {"api": _API, "escalate": _ESCALATE, "rag": _RAG}
+_KEYWORD_DECISIONS = {
+    "api": {"action": "api", "confidence": 0.85, "reason": "Keyword match: live data request"},
+    "escalate": {"action": "escalate", "confidence": 0.85, "reason": "Keyword match: needs a human"},
+    "rag": {"action": "rag", "confidence": 0.75, "reason": "Keyword match: manual knowledge"},
+}
+# Outcome per bitmask of the intents found: a single intent decides, API
+# outranks RAG (the prompt's decision priority), any other mix goes to the LLM
+_KEYWORD_OUTCOMES: Tuple[Optional[dict], ...] = tuple(
+    {
+        _API: _KEYWORD_DECISIONS["api"],
+        _ESCALATE: _KEYWORD_DECISIONS["escalate"],
+        _RAG: _KEYWORD_DECISIONS["rag"],
+        _API | _RAG: _KEYWORD_DECISIONS["api"],
+    }.get(mask)
+    for mask in range(8)
+)
+
+# parse_signals repairs: bare keys, list bodies, numeric list items
+_KEY_RE = re.compile(r"(\b\w+\b)\s*:")
+_LIST_RE = re.compile(r"\[(.*?)\]")
+_NUM_RE = re.compile(r"-?\d+(\.\d+)?")
+
+
+def _quote_list_items(m: re.Match) -> str:
+    items = [p.strip() for p in m.group(1).split(",") if p.strip()]
+    fixed_items = []
+    for p in items:
+        if p.startswith('"') or p.startswith("'"):
+            val = p.strip('"').strip("'")
+            fixed_items.append(f'"{val}"')
+        elif _NUM_RE.fullmatch(p):
+            fixed_items.append(p)
+        else:
+            fixed_items.append(f'"{p}"')
+    return "[" + ",".join(fixed_items) + "]"
+
+
+def _repair_candidates(s: str) -> Iterator[str]:
+    """Repaired variants of ``s``, cheapest first; each is built only if the last failed."""
+    # Strip outer quotes if present
+    if (s.startswith("'") and s.endswith("'")) or (s.startswith('"') and s.endswith('"')):
+        yield s[1:-1]
+    # Try replacing single quotes with double quotes
+    yield s.replace("'", '"')
+    # Try fixing missing quotes around keys/array items
+    yield _LIST_RE.sub(_quote_list_items, _KEY_RE.sub(r'"\1":', s))
+
 
 def parse_signals(raw: str) -> dict:
     """Robustly parse retrieval signals from CLI string."""
@@ -26,112 +157,343 @@ def parse_signals(raw: str) -> dict:
     s = str(raw).strip()
     if not s:
         return {}
-    candidates = [s]
-    # Strip outer quotes if present
-    if (s.startswith("'") and s.endswith("'")) or (s.startswith('"') and s.endswith('"')):
-        candidates.append(s[1:-1])
-    # Try replacing single quotes with double quotes
-    candidates.append(s.replace("'", '"'))
-
-    # Try fixing missing quotes around keys/array items
-    import re
-
-    def fix_lists(txt: str) -> str:
-        def repl(m):
-            items = [p.strip() for p in m.group(1).split(",") if p.strip()]
-            fixed_items = []
-            for p in items:
-                if p.startswith('"') or p.startswith("'"):
-                    val = p.strip('"').strip("'")
-                    fixed_items.append(f'"{val}"')
-                elif re.fullmatch(r"-?\d+(\.\d+)?", p):
-                    fixed_items.append(p)
-                else:
-                    fixed_items.append(f'"{p}"')
-            return "[" + ",".join(fixed_items) + "]"
-
-        return re.sub(r"\[(.*?)\]", repl, txt)
-
-    fixed = re.sub(r"(\b\w+\b)\s*:", r'"\1":', s)
-    fixed = fix_lists(fixed)
-    candidates.append(fixed)
-
-    for cand in candidates:
+    # Well-formed JSON (the common case) needs no repair attempts
+    try:
+        return json.loads(s)
+    except ValueError:
+        pass
+    for cand in _repair_candidates(s):
         try:
             return json.loads(cand)
         except Exception:
             continue
-    try:
-        import ast
+    # Last resort: a JSON repairer rather than the Python AST parser; it also
+    # reads Python-style literals (single quotes, True/None)
+    from json_repair import loads as repair_loads
 
-        return ast.literal_eval(s)
+    try:
+        repaired = repair_loads(s)
     except Exception:
         return {}
+    return repaired if isinstance(repaired, dict) else {}
+
+
+_HARD_RULES_TEXT = (
+    "## Hard Rules (ALWAYS apply these first):\n"
+    "1. If top1>={} AND avg_top5>={} AND hits>={} → action=rag, confidence=0.9\n"
+    "2. If top1<{} OR avg_top5<{} OR hits<{} → action=escalate, confidence=0.9\n"
+    "3. Otherwise, use intent-based routing below (PRIORITIZE API for order/inventory/price queries)\n\n"
+).format(*RAG_THRESHOLDS, *ESCALATE_THRESHOLDS)
+
+ROUTER_SYSTEM_TEXT = (
+    "You are a routing assistant for a coffee machine support system. Decide the best action for the user query.\n"
+    "Possible actions: rag, escalate, db, api.\n\n"
+    + _HARD_RULES_TEXT
+    + "## Intent-Based Routing (if hard rules don't apply):\n\n"
+    
+    "### API (confidence=0.85) - Use when query asks for LIVE/REAL-TIME data:\n"
+    "**Trigger keywords**: order, status, tracking, inventory, stock, availability, price, shipping, delivery, service status, uptime, payment, transaction\n"
+    "**Examples**:\n"
+    "- 'check my order ORD12345' → api\n"
+    "- 'what is my order status' → api\n"
+    "- 'is the coffee machine in stock' → api\n"
+    "- 'check inventory' → api\n"
+    "- 'how much does it cost' → api (real-time price)\n"
+    "- 'what is the service status' → api\n"
+    "- 'track my shipment' → api\n\n"
+    
+    "### RAG (confidence=0.75) - Use for STATIC knowledge from manuals:\n"
+    "**Trigger keywords**: how to, troubleshoot, fix, problem, issue, manual, guide, instructions, features, specifications\n"
+    "**Examples**:\n"
+    "- 'my coffee is not hot' → rag (troubleshooting)\n"
+    "- 'how to clean the machine' → rag (instructions)\n"
+    "- 'what does the red light mean' → rag (manual)\n"
+    "- 'how to adjust grinder' → rag (how-to)\n\n"
+    
+    "### ESCALATE (confidence=0.85) - Use when cannot be handled:\n"
+    "**Trigger keywords**: complaint, refund, warranty claim, legal, safety concern, human agent, speak to someone\n"
+    "**Examples**:\n"
+    "- 'I want a refund' → escalate\n"
+    "- 'this is unacceptable' → escalate\n"
+    "- 'connect me to support' → escalate\n\n"
+    
+    "### DB (confidence=0.80) - Use for structured data lookups:\n"
+    "**Examples**: customer records, purchase history, warranty records (not implemented yet)\n\n"
+    
+    "## Decision Priority:\n"
+    "1. Check hard rules first (retrieval scores)\n"
+    "2. **HIGHEST PRIORITY**: If query contains API keywords (order/status/tracking/inventory/stock/price) → api\n"
+    "3. If query is about product usage/troubleshooting → rag\n"
+    "4. If query needs human intervention → escalate\n\n"
+    "**CRITICAL**: Queries about orders, inventory, prices, or service status should ALWAYS use 'api', "
+    "even if retrieval scores are low. Low retrieval scores for such queries are EXPECTED because this "
+    "information is not in the knowledge base.\n\n"
+    
+    "Respond in JSON: {\"action\": \"rag|escalate|db|api\", \"confidence\": 0.0-1.0, \"reason\": \"at most 15 words\"}"
+)
 
 
 def build_router_messages(query: str, retrieval_signals: dict) -> List[dict]:
-    system_text = (
-        "You are a routing assistant for a coffee machine support system. Decide the best action for the user query.\n"
-        "Possible actions: rag, escalate, db, api.\n\n"
-        
-        "## Hard Rules (ALWAYS apply these first):\n"
-        "1. If top1>=0.5 AND avg_top5>=0.35 AND hits>=3 → action=rag, confidence=0.9\n"
-        "2. If top1<0.15 OR avg_top5<0.10 OR hits<2 → action=escalate, confidence=0.9\n"
-        "3. Otherwise, use intent-based routing below (PRIORITIZE API for order/inventory/price queries)\n\n"
-        
-        "## Intent-Based Routing (if hard rules don't apply):\n\n"
-        
-        "### API (confidence=0.85) - Use when query asks for LIVE/REAL-TIME data:\n"
-        "**Trigger keywords**: order, status, tracking, inventory, stock, availability, price, shipping, delivery, service status, uptime, payment, transaction\n"
-        "**Examples**:\n"
-        "- 'check my order ORD12345' → api\n"
-        "- 'what is my order status' → api\n"
-        "- 'is the coffee machine in stock' → api\n"
-        "- 'check inventory' → api\n"
-        "- 'how much does it cost' → api (real-time price)\n"
-        "- 'what is the service status' → api\n"
-        "- 'track my shipment' → api\n\n"
-        
-        "### RAG (confidence=0.75) - Use for STATIC knowledge from manuals:\n"
-        "**Trigger keywords**: how to, troubleshoot, fix, problem, issue, manual, guide, instructions, features, specifications\n"
-        "**Examples**:\n"
-        "- 'my coffee is not hot' → rag (troubleshooting)\n"
-        "- 'how to clean the machine' → rag (instructions)\n"
-        "- 'what does the red light mean' → rag (manual)\n"
-        "- 'how to adjust grinder' → rag (how-to)\n\n"
-        
-        "### ESCALATE (confidence=0.85) - Use when cannot be handled:\n"
-        "**Trigger keywords**: complaint, refund, warranty claim, legal, safety concern, human agent, speak to someone\n"
-        "**Examples**:\n"
-        "- 'I want a refund' → escalate\n"
-        "- 'this is unacceptable' → escalate\n"
-        "- 'connect me to support' → escalate\n\n"
-        
-        "### DB (confidence=0.80) - Use for structured data lookups:\n"
-        "**Examples**: customer records, purchase history, warranty records (not implemented yet)\n\n"
-        
-        "## Decision Priority:\n"
-        "1. Check hard rules first (retrieval scores)\n"
-        "2. **HIGHEST PRIORITY**: If query contains API keywords (order/status/tracking/inventory/stock/price) → api\n"
-        "3. If query is about product usage/troubleshooting → rag\n"
-        "4. If query needs human intervention → escalate\n\n"
-        "**CRITICAL**: Queries about orders, inventory, prices, or service status should ALWAYS use 'api', "
-        "even if retrieval scores are low. Low retrieval scores for such queries are EXPECTED because this "
-        "information is not in the knowledge base.\n\n"
-        
-        "Respond ONLY in JSON: {\"action\": \"rag|escalate|db|api\", \"confidence\": 0.0-1.0, \"reason\": \"...\"}"
-    )
-    user_text = (
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    # Fresh messages per call (only the user text is memoized), so appending a
+    # turn or editing a message can't leak into later queries
+    user_text = _router_user_text(query, json_dumps(retrieval_signals))
+    return [SystemMessage(content=ROUTER_SYSTEM_TEXT), HumanMessage(content=user_text)]
+
+
+@lru_cache(maxsize=1024)
+def _router_user_text(query: str, signals_json: str) -> str:
+    # Signals are keyed by their JSON text, so repeated (query, signals) pairs
+    # (retries, eval re-runs) reuse the formatted text
+    return (
         f"query: {query}\n"
-        f"retrieval_signals: {json.dumps(retrieval_signals, ensure_ascii=False)}\n"
+        f"retrieval_signals: {signals_json}\n"
         "Apply the numeric rules first. If a rule matches, output it directly. Otherwise, decide by intent."
     )
-    return [SystemMessage(content=system_text), HumanMessage(content=user_text)]
+
+
+# Numeric retrieval signals and their types; missing/None/empty values read as 0
+_SIGNAL_SCHEMA = (("top1", float), ("avg_top5", float), ("hits", int))
+
+
+def signal_values(signals: dict) -> Tuple[float, float, int]:
+    """``(top1, avg_top5, hits)`` from a signals dict, coerced in one pass."""
+    return tuple(cast(signals.get(key) or 0) for key, cast in _SIGNAL_SCHEMA)
+
+
+def apply_hard_rules(signals: dict) -> Optional[dict]:
+    """Return the hard-rule decision for the retrieval signals, or None in the gray zone."""
+    top1, avg5, hits = signal_values(signals)
+
+    # Adjusted rules: more lenient for RAG, stricter for escalate
+    rag_top1, rag_avg5, rag_hits = RAG_THRESHOLDS
+    if top1 >= rag_top1 and avg5 >= rag_avg5 and hits >= rag_hits:
+        return {"action": "rag", "confidence": 0.9, "reason": "High retrieval scores (relaxed threshold)"}
+
+    # IMPORTANT: Only escalate on extremely low scores
+    # For API queries (order/inventory/price), let LLM decide even if scores are low
+    low_top1, low_avg5, low_hits = ESCALATE_THRESHOLDS
+    if top1 < low_top1 or avg5 < low_avg5 or hits < low_hits:
+        return {"action": "escalate", "confidence": 0.9, "reason": "Extremely low retrieval scores"}
+    return None
+
+
+def classify_by_keywords(query: str) -> Optional[dict]:
+    """Route by the prompt's trigger keywords when they point one way, else None.
+
+    API keywords outrank RAG ones, as in the prompt's decision priority; any
+    other mix of intents is left to the LLM.
+    """
+    mask = 0
+    for m in _KEYWORD_RE.finditer(query):
+        mask |= _KEYWORD_BITS[m.lastgroup]
+    decision = _KEYWORD_OUTCOMES[mask]
+    return dict(decision) if decision is not None else None
+
+
+_PARSE_FAILURE = {"action": "escalate", "confidence": 0.5, "reason": "Could not parse router output"}
+
+
+@lru_cache(maxsize=8)
+def get_router_llm(
+    model: str,
+    temperature: float = 0.0,
+    timeout: Optional[float] = None,
+    max_tokens: int = ROUTER_MAX_TOKENS,
+    stop: Optional[Tuple[str, ...]] = None,
+) -> ChatOpenAI:
+    """Router client, built once per distinct configuration per process.
+
+    Models that support structured output are held to ``ROUTER_RESPONSE_FORMAT``;
+    other backends get plain JSON mode.
+
+    Also loads ``.env`` (for ``OPENAI_API_KEY``) the first time an LLM is needed.
+    """
+    from dotenv import load_dotenv
+    from langchain_openai import ChatOpenAI
+
+    load_dotenv()
+    # Other OpenAI-compatible backends may reject unknown request fields
+    extra_body = None
+    if model.startswith(_OPENAI_MODEL_PREFIXES):
+        extra_body = {"prompt_cache_key": ROUTER_PROMPT_CACHE_KEY}
+    response_format = {"type": "json_object"}
+    if model.startswith(_SCHEMA_MODEL_PREFIXES):
+        response_format = ROUTER_RESPONSE_FORMAT
+    return ChatOpenAI(
+        model=model,
+        temperature=temperature,
+        timeout=timeout,
+        max_tokens=max_tokens,
+        stop=list(stop) if stop else None,
+        model_kwargs={"response_format": response_format},
+        extra_body=extra_body,
+    )
+
+
+def _parse_router_output(content: str) -> Optional[dict]:
+    try:
+        result = json_loads_llm(content)
+    except json.JSONDecodeError:
+        # A stop sequence of "}" leaves the object unclosed
+        if content.rstrip().endswith("}"):
+            return None
+        try:
+            result = json_loads_llm(content.rstrip() + "}")
+        except json.JSONDecodeError:
+            return None
+    if not isinstance(result, dict) or "action" not in result:
+        return None
+    return result
+
+
+# Streamed router output: action and confidence settle the route; a number only
+# counts once its terminator has arrived, so "0.8" is never read as "0."
+_ACTION_RE = re.compile(r'"action"\s*:\s*"(rag|escalate|db|api)"')
+_CONFIDENCE_RE = re.compile(r'"confidence"\s*:\s*(-?\d+(?:\.\d+)?)\s*[,}]')
+_REASON_RE = re.compile(r'"reason"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+
+def _stream_router_output(llm: ChatOpenAI, messages: list) -> Optional[dict]:
+    """Stream the router reply and stop once action and confidence are known.
+
+    Escalations are read to the end, since their reason becomes the ticket
+    reason; for other actions the reason is kept only if it already arrived.
+    """
+    parts: List[str] = []
+    for chunk in llm.stream(messages):
+        parts.append(chunk.content)
+        text = "".join(parts)
+        action = _ACTION_RE.search(text)
+        confidence = _CONFIDENCE_RE.search(text)
+        if action is None or confidence is None or action.group(1) == "escalate":
+            continue
+        reason = _REASON_RE.search(text)
+        return {
+            "action": action.group(1),
+            "confidence": float(confidence.group(1)),
+            "reason": json_loads(reason.group(1)) if reason else "Intent-based routing",
+        }
+    return _parse_router_output("".join(parts))
+
+
+def decide_action(
+    query: str,
+    signals: dict,
+    model: str = "gpt-4o-mini",
+    temperature: float = 0.0,
+    timeout: Optional[float] = None,
+    query_embedding: Optional[Sequence[float]] = None,
+    use_cache: bool = True,
+    max_tokens: int = ROUTER_MAX_TOKENS,
+    stop: Optional[Tuple[str, ...]] = None,
+) -> dict:
+    """Apply the hard numeric rules and keyword triggers, then fall back to the LLM.
+
+    LLM decisions are cached on disk per model (see ``utils.router_cache``);
+    pass ``query_embedding`` to also match near-duplicate queries and, when
+    ``RAG_ROUTER_CLASSIFIER=1``, to let the cache's nearest-centroid classifier
+    settle clear cases locally.
+    """
+    decision = apply_hard_rules(signals) or classify_by_keywords(query)
+    if decision is not None:
+        return decision
+
+    cache = get_router_cache(model) if use_cache else None
+    if cache is not None:
+        decision = cache.get(query, signals, query_embedding)
+        if decision is None and query_embedding is not None:
+            decision = cache.classify(query_embedding)
+        if decision is not None:
+            return decision
+
+    # Otherwise, defer to LLM for intent-based routing
+    messages = build_router_messages(query, signals)
+    llm = get_router_llm(model, temperature, timeout, max_tokens, stop)
+    result = _stream_router_output(llm, messages)
+    if result is None:
+        return dict(_PARSE_FAILURE)
+    if cache is not None:
+        cache.put(query, signals, result, query_embedding)
+    return result
+
+
+def decide_actions(
+    rows: Sequence[Tuple[str, dict]],
+    model: str = "gpt-4o-mini",
+    temperature: float = 0.0,
+    timeout: Optional[float] = None,
+    concurrency: int = 8,
+    use_cache: bool = True,
+    max_tokens: int = ROUTER_MAX_TOKENS,
+    stop: Optional[Tuple[str, ...]] = None,
+) -> List[dict]:
+    """``decide_action`` for many ``(query, signals)`` rows, in input order.
+
+    Rows settled by the hard rules, keywords or cache never reach the LLM; the
+    rest go out together through ``llm.batch`` with up to ``concurrency``
+    requests in flight.
+    """
+    cache = get_router_cache(model) if use_cache else None
+    results: List[Optional[dict]] = []
+    pending: List[int] = []
+    for i, (query, signals) in enumerate(rows):
+        decision = apply_hard_rules(signals) or classify_by_keywords(query)
+        if decision is None and cache is not None:
+            decision = cache.get(query, signals)
+        if decision is None:
+            pending.append(i)
+        results.append(decision)
+
+    if pending:
+        llm = get_router_llm(model, temperature, timeout, max_tokens, stop)
+        responses = llm.batch(
+            [build_router_messages(*rows[i]) for i in pending],
+            config={"max_concurrency": concurrency},
+            return_exceptions=True,
+        )
+        for i, resp in zip(pending, responses):
+            if isinstance(resp, Exception):
+                results[i] = {"action": "escalate", "confidence": 0.0, "reason": f"Router exception: {resp}"}
+                continue
+            result = _parse_router_output(resp.content)
+            if result is None:
+                results[i] = dict(_PARSE_FAILURE)
+                continue
+            if cache is not None:
+                cache.put(*rows[i], result)
+            results[i] = result
+    return results
+
+
+def run_batch(queries_file: Path, **options) -> None:
+    """Route every ``{query, retrieval_signals}`` line of a JSONL file; print JSONL results.
+
+    ``options`` are passed on to ``decide_actions``.
+    """
+    rows = []
+    with queries_file.open(encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json_loads(line)
+                rows.append((item["query"], parse_signals(item.get("retrieval_signals", {}))))
+    results = decide_actions(rows, **options)
+    # All result lines serialized up front and written in one call
+    lines = [json_line({"query": query, "result": result}) for (query, _), result in zip(rows, results)]
+    sys.stdout.buffer.write(b"".join(lines))
+    sys.stdout.flush()
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="LLM Router")
-    parser.add_argument("--query", required=True, help="user query")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--query", help="user query")
+    source.add_argument(
+        "--queries-file",
+        type=Path,
+        help='JSONL of {"query": ..., "retrieval_signals": {...}}; prints one JSON result per line',
+    )
     parser.add_argument(
         "--retrieval-signals",
         default="{}",
@@ -145,9 +507,32 @@ def main() -> None:
         "--model", default="gpt-4o-mini", help="OpenAI-compatible chat model for routing"
     )
     parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--no-cache", action="store_true", help="bypass the routing decision cache")
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="max LLM requests in flight with --queries-file"
+    )
+    parser.add_argument(
+        "--max-tokens", type=int, default=ROUTER_MAX_TOKENS, help="cap on router output tokens"
+    )
+    parser.add_argument(
+        "--stop", nargs="*", default=None, help='stop sequences, e.g. --stop "}" (the object is closed afterwards)'
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="print the parsed signals to stderr before routing"
+    )
     args = parser.parse_args()
 
-    load_dotenv()
+    options = {
+        "model": args.model,
+        "temperature": args.temperature,
+        "use_cache": not args.no_cache,
+        "max_tokens": args.max_tokens,
+        "stop": tuple(args.stop) if args.stop else None,
+    }
+    if args.queries_file is not None:
+        run_batch(args.queries_file, concurrency=args.concurrency, **options)
+        return
+
     signals = parse_signals(args.retrieval_signals)
     if args.top1 is not None:
         signals["top1"] = args.top1
@@ -158,39 +543,22 @@ def main() -> None:
     if args.sections is not None:
         signals["sections"] = args.sections
 
-    # Hard rule override
-    top1 = float(signals.get("top1", 0) or 0)
-    avg5 = float(signals.get("avg_top5", 0) or 0)
-    hits = int(signals.get("hits", 0) or 0)
-    debug_info = {
-        "top1": top1,
-        "avg_top5": avg5,
-        "hits": hits,
-        "raw_signals": signals,
-        "raw_input": args.retrieval_signals,
-    }
-    print(json.dumps({"debug_signals": debug_info}, ensure_ascii=False))
+    if args.debug:
+        # stderr keeps stdout to the single result line
+        top1, avg5, hits = signal_values(signals)
+        debug_info = {
+            "top1": top1,
+            "avg_top5": avg5,
+            "hits": hits,
+            "raw_signals": signals,
+            "raw_input": args.retrieval_signals,
+        }
+        print(json_dumps({"debug_signals": debug_info}), file=sys.stderr)
 
-    # Adjusted rules: more lenient for RAG, stricter for escalate
-    if top1 >= 0.5 and avg5 >= 0.35 and hits >= 3:
-        result = {"action": "rag", "confidence": 0.9, "reason": "High retrieval scores (relaxed threshold)"}
-        print(json.dumps(result, ensure_ascii=False))
-        return
-    
-    # IMPORTANT: Only escalate on extremely low scores
-    # For API queries (order/inventory/price), let LLM decide even if scores are low
-    if top1 < 0.15 or avg5 < 0.10 or hits < 2:
-        result = {"action": "escalate", "confidence": 0.9, "reason": "Extremely low retrieval scores"}
-        print(json.dumps(result, ensure_ascii=False))
-        return
-
-    # Otherwise, defer to LLM for intent-based routing
-    messages = build_router_messages(args.query, signals)
-    llm = ChatOpenAI(model=args.model, temperature=args.temperature)
-    resp = llm.invoke(messages)
-    print(resp.content)
+    result = decide_action(args.query, signals, **options)
+    sys.stdout.buffer.write(json_line(result))
+    sys.stdout.flush()
 
 
 if __name__ == "__main__":
     main()
-